@@ -1,398 +1,380 @@
+import functools
+import os
+import threading
+
 import pandas as pd
 import numpy as np
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-
-@st.cache(ttl=3600,max_entries=50000)
-def get_data():
-
-    # the file read it's 200MB too big for download
-    '''
-    url = 'https://www.datos.gov.co/api/views/gt2j-8ykr/rows.csv?'
-    url = url + 'accessType=DOWNLOAD&bom=true&format=true&delimiter=%3B'
-
-    
-    #Por si algo sale mal al momento de leer los datos
-    try:
-        data = pd.read_csv(url, sep=';')
-    except:
-        data = pd.read_csv('dataset/Casos_positivos_de_COVID-19_en_Colombia.csv', sep=';')
-    '''
-    #Leer código Division Pólitica Admin para corregir posibles falata de datos
-    #con el nombre del departamento
-    df_cod_divipola = pd.read_excel('dataset/codigo_divipola.xls')
-    cod_divipola_dict = dict(zip(df_cod_divipola.CODIGO, df_cod_divipola.DEPARTAMENTO))
-
-    #read off-line
-    data = pd.read_csv('dataset/Casos_positivos_de_COVID-19_en_Colombia.csv', sep=';')
-
-
-    #Replace \n (newline) for all columns
-    data.rename(columns=lambda s: s.replace(' ', '_'), inplace=True)
-    data.rename(columns={'ID_de_caso':'casos'}, inplace=True)
-
-    #Corregir departamentos sin datos NaN
-    #buscar el nombre en el diccionario apartir del código
-    data.loc[data['Departamento_o_Distrito_'].isnull(),'Departamento_o_Distrito_'] = data['Código_DIVIPOLA'].map(cod_divipola_dict)
-
-    #Corregir NaN en departamento y Ciudad (Solo si el código anterior no funcionó)
-    data['Departamento_o_Distrito_'].fillna('No definido', inplace=True)
-    data['Ciudad_de_ubicación'].fillna('No definido', inplace=True)
-
-
-    #Información de latitud y longitud para los departamentos del dataset(únicamente)
-    data_geo = pd.read_csv('dataset/departamentos_geocode_lat_lon.csv')
-
-    #Feature Engineering
-    #Fechas
-    data['FIS'] = pd.to_datetime(data['FIS'], format='%Y-%m-%d', errors='coerce', yearfirst=True, exact=False)
-
-    data['Fecha_de_muerte'] = pd.to_datetime(data['Fecha_de_muerte'], format='%Y-%m-%d', errors='coerce',   
-    yearfirst=True, exact=False)
-
-    data['Fecha_diagnostico'] = pd.to_datetime(data['Fecha_diagnostico'], format='%Y-%m-%d', errors='coerce', 
-    yearfirst=True, exact=False)
-
-    data['Fecha_recuperado'] = pd.to_datetime(data['Fecha_recuperado'], format='%Y-%m-%d', errors='coerce', 
-    yearfirst=True, exact=False)
-
-    data['fecha_reporte_web'] = pd.to_datetime(data['fecha_reporte_web'], format='%Y-%m-%d', errors='coerce', 
-    yearfirst=True, exact=False)
-
-    #Estado
-    data['Estado'] = np.where(data['Estado'] == 'leve', 'Leve', data['Estado'])
-    data['Estado'] = data['Estado'].str.strip()
-    data['Departamento_o_Distrito_'] = data['Departamento_o_Distrito_'].str.strip()
-    data['Ciudad_de_ubicación'] = data['Ciudad_de_ubicación'].str.strip()
-    data['País_de_procedencia'] = data['País_de_procedencia'].str.strip()
-    data['Sexo'] = data['Sexo'].str.strip()
-    data['atención'] = data['atención'].str.strip()
-    data['Tipo'] = data['Tipo'].str.strip()
-    data['Sexo'] = data['Sexo'].str.upper()
-
-    #Feature Engenieering
-    #New Features
-    data['Recuperado'] = np.where(data['atención'] == 'Recuperado', 'Si', 'No')
-    data['Falleció'] = np.where(data['atención'] == 'Fallecido', 'Si', 'No')
-    data['Extranjero'] = np.where(data['País_de_procedencia'] == 'Colombia', 'No', 'Si')
-
-    #Edad
-    data['Rango_Edad'] = pd.cut(x=data['Edad'], bins=[0, 5, 15, 25, 45, 65, 75, 999],
-                        labels=['0-5', '5-15', '15-25', '25-45', '45-65', '65-75', '75->'])
-
-    #Días Recuperación
-    data['FIS'].fillna(data['fecha_reporte_web'], inplace=True)
-    data['Días de tratamiento'] = abs(data['fecha_reporte_web'] - data['FIS'])
-    data['Días de tratamiento'] = data['Días de tratamiento'].astype('timedelta64[D]')
-    data['Días de tratamiento'].fillna(0, inplace=True)
-    data['Días de tratamiento'] = data['Días de tratamiento'].astype(int)
-
-    #Latitud y Longitud (para Departamento)
-    data = data.join(data_geo.set_index('Departamento'), on='Departamento_o_Distrito_')
-
-    #Definir Fecha Reporte Web como indice
-    #data = data.rename(columns={'fecha_reporte_web':'index'}).set_index('index')
-
-    #Return data
-    return data
-
-@st.cache(ttl=3600,max_entries=50000)
-def get_data_velocidad_propagacion(df):
-    dg = df.groupby([pd.Grouper(key='fecha_reporte_web', freq='W', label='right')])['fecha_reporte_web'].count().to_frame()
-    dg.drop(dg.tail(1).index,inplace=True) #drop last row, incomplete 5D seven days
-    dg.rename(columns={'fecha_reporte_web':'Número de casos'}, inplace=True)
-    dg.drop(dg[dg.index < '2020-03-15'].index, inplace=True)
-    dg['Fila Anterior Número de casos'] = dg['Número de casos'].shift()
-    dg['Velocidad de Propagación'] = dg['Número de casos'] / dg['Fila Anterior Número de casos']
-
-    #Return data
-    return dg
-
-@st.cache(ttl=3600,max_entries=50000)
-def get_data_recuperados(df):
-    recu_df = pd.crosstab(df['fecha_reporte_web'],df['Recuperado'], margins=True,
-                    margins_name='Total', rownames=['Fecha'], colnames=['Recuperado'])
-    recu_df['Recuperados Acumulado'] = recu_df['Si'].cumsum()
-    recu_df['Total Recuperados Acumulado'] = recu_df['Total'].cumsum()
-    recu_df['% Acumulado Recuperados'] = (recu_df['Recuperados Acumulado'] / recu_df['Total Recuperados Acumulado'])*100
-
-    #Return data
-    return recu_df
-
-@st.cache(ttl=3600,max_entries=50000)
-def get_data_fallecidos(df):
-    fallecio_df = pd.crosstab(df['fecha_reporte_web'],df['Falleció'], margins=True,
-                        margins_name='Total', rownames=['Fecha'], colnames=['Fallecido'])
-    try:
-        fallecio_df['Fallecidos Acumulado'] = fallecio_df['Si'].cumsum()
-        fallecio_df['Total Fallecidos Acumulado'] = fallecio_df['Total'].cumsum()
-        fallecio_df['% Acumulado Fallecidos'] = (fallecio_df['Fallecidos Acumulado'] / fallecio_df['Total Fallecidos Acumulado'])*100
-    except:
-        fallecio_df['Fallecidos Acumulado'] = 0
-        fallecio_df['Total Fallecidos Acumulado'] = 0
-        fallecio_df['% Acumulado Fallecidos'] = 0
-    #Return data
-    return fallecio_df
+
+from covidcol import aggregate, cities, cube, figcache, figures, growth, kpis, precompute, prefix, refresh, sir, store, survival, timing
+
+#Cache local (dataset/cache): se reconstruye desde el CSV del INS si los
+#archivos fuente cambian, sin cargar la tabla si ya está al día
+@st.cache(ttl=3600,max_entries=1)
+def update_cache():
+    return store.update(store.CACHE_DIR)
+
+#Directorio de datos: la última versión publicada por python -m covidcol.refresh
+#o, si no hay ninguna, el cache local que se construye en este proceso.
+#Se resuelve una vez en cada ejecución de la página al directorio real de la
+#versión (no al enlace dataset/cache) y todas las funciones en cache dependen
+#de él, así que una versión nueva reemplaza a la anterior sin reiniciar y una
+#ejecución no mezcla archivos de dos versiones si el enlace cambia a mitad
+def get_data_dir():
+    publicada = refresh.current_dir()
+    if publicada:
+        return os.path.realpath(publicada)
+    update_cache()
+    return os.path.realpath(store.CACHE_DIR)
+
+def is_local_cache(data_dir):
+    return os.path.dirname(data_dir) == os.path.realpath(store.CACHE_DIR + '.d')
+
+#Versión de los datos del directorio, desde su manifiesto
+@st.cache(max_entries=2)
+def get_version(data_dir):
+    return store.read_manifest(data_dir)['version']
+
+#Tabla completa. Solo se carga si hay que construir algún derivado
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_data(data_dir, version):
+    return store.load_table(data_dir)
+
+#Cubo de conteos por departamento/día/sexo/edad/resultado, se construye una
+#vez por versión de los datos y las gráficas solo lo cortan. Los derivados
+#reciben la tabla como función: si ya están guardados no se carga
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_cube(data_dir, version):
+    return cube.load_or_build(lambda: get_data(data_dir, version), data_dir)
+
+#Cifras precalculadas (python -m covidcol.refresh o covidcol.precompute) para
+#la versión actual de los datos (None si no se han generado)
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_resultados(data_dir, version):
+    return precompute.load_results(data_dir)
+
+#Promedio 7 días, factor de crecimiento, tiempo de duplicación y Rt de todos
+#los departamentos, una vez por versión
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_growth(data_dir, version):
+    return growth.load_or_build(get_cube(data_dir, version), data_dir)
+
+#Histogramas de días hasta la recuperación y la muerte por departamento y
+#rango de edad (curvas de Kaplan-Meier y cuantiles)
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_survival(data_dir, version):
+    return survival.load_or_build(lambda: get_data(data_dir, version), data_dir)
+
+#Distribución de edades, edad vs. días de tratamiento y casos por departamento
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_agregados(data_dir, version):
+    return aggregate.load_or_build(lambda: get_data(data_dir, version), data_dir)
+
+#Sumas acumuladas por día para los filtros de fecha, sexo, edad, tipo y extranjero
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_prefix(data_dir, version):
+    return prefix.load_or_build(lambda: get_data(data_dir, version), data_dir)
+
+#Índice por (departamento, municipio): filas, casos diarios y totales
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_cities(data_dir, version):
+    return cities.load_or_build(lambda: get_data(data_dir, version), data_dir)
+
+#KPIs de todos los departamentos en un solo recorrido de la tabla
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_kpis(data_dir, version):
+    resultados = get_resultados(data_dir, version)
+    if resultados:
+        return {depto: r['kpis'] for depto, r in resultados.items()}
+    return kpis.compute_kpis(get_data(data_dir, version))
+
+#Cifras de cada sección por (versión de datos, departamento): solo se calculan
+#cuando la sección está abierta y al volver a un departamento ya están en cache
+@st.cache(ttl=3600,max_entries=100,allow_output_mutation=True)
+def get_velocidad_actual(data_dir, version, depto):
+    resultados = get_resultados(data_dir, version)
+    if resultados:
+        return resultados[depto]['velocidad_propagacion']
+    dg = get_data_velocidad_propagacion(data_dir, version, depto)
+    return dg[dg.index==dg.index.max()]['Velocidad de Propagación'][0]
+
+@st.cache(ttl=3600,max_entries=100,allow_output_mutation=True)
+def get_ajuste_sir(data_dir, version, depto):
+    resultados = get_resultados(data_dir, version)
+    if resultados:
+        return resultados[depto]['sir']
+    return sir.fit_depto(get_cube(data_dir, version), depto)[1]
+
+@st.cache(ttl=3600,max_entries=100,allow_output_mutation=True)
+def get_recuperados_por_depto(data_dir, version, depto):
+    return cube.recuperados_por_depto(get_cube(data_dir, version), depto)
+
+@st.cache(ttl=3600,max_entries=100,allow_output_mutation=True)
+def get_ciudades(data_dir, version, depto):
+    return get_cities(data_dir, version).cities(depto)
+
+#Totales, edad promedio (solo las filas del municipio, desde el índice, de la
+#columna Edad abierta con mmap, sin cargar la tabla) y casos diarios de un
+#municipio. Índice y columna se leen del mismo directorio de versión
+@st.cache(ttl=3600,max_entries=100,allow_output_mutation=True)
+def get_municipio(data_dir, version, depto, municipio):
+    ciudades = get_cities(data_dir, version)
+    edades = np.asarray(store.load_column('Edad', data_dir))[ciudades.rows(depto, municipio)]
+    serie = ciudades.series(depto, municipio)
+    return ciudades.totals(depto, municipio), edades.mean(), serie.loc[cube.trim(serie['Casos']).index]
+
+#Agregados de los que salen todas las gráficas (no dependen del número de
+#casos). Cada uno se abre cuando la primera figura que lo usa no está en cache
+@st.cache(ttl=3600,max_entries=2,allow_output_mutation=True)
+def get_fuentes(data_dir, version):
+    cargas = {
+        'cubo': lambda: get_cube(data_dir, version),
+        'edades': lambda: get_agregados(data_dir, version).edades,
+        'edad_tratamiento': lambda: get_agregados(data_dir, version).edad_tratamiento,
+        'casos_por_depto': lambda: get_agregados(data_dir, version).casos_por_depto,
+        'crecimiento': lambda: get_growth(data_dir, version),
+        'supervivencia': lambda: get_survival(data_dir, version),
+    }
+    return figures.Fuentes(lambda nombre: cargas[nombre]())
+
+#Figuras serializadas por (sección, departamento, versión de datos); las de una
+#versión publicada ya vienen en su directorio
+@st.cache(max_entries=2,allow_output_mutation=True)
+def get_figure_cache(fig_dir):
+    return figcache.FigureCache(disk_dir=fig_dir)
+
+def get_fig_dir():
+    if is_local_cache(data_dir):
+        return figcache.FIG_DIR
+    return os.path.join(data_dir, refresh.FIG_SUBDIR)
+
+#Pre-render de todos los departamentos en segundo plano, una vez por versión
+#(una versión publicada ya trae sus figuras)
+@st.cache(max_entries=10)
+def prewarm_figures(version):
+    if is_local_cache(data_dir):
+        threading.Thread(target=figcache.prewarm, args=(get_figure_cache(get_fig_dir()),
+                                                        functools.partial(get_fuentes, data_dir, version),
+                                                        cubo.deptos, version),
+                         daemon=True).start()
+    return version
+
+def get_figure(seccion, depto):
+    return figcache.figure(get_figure_cache(get_fig_dir()), lambda: get_fuentes(data_dir, version), seccion, depto,
+                           version)
+
+def get_data_velocidad_propagacion(data_dir, version, depto='Colombia'):
+    return cube.velocidad_propagacion(get_cube(data_dir, version), depto)
+
+#Días de un cuantil; NaN si la curva todavía no llega a ese cuantil
+def formato_dias(dias):
+    return "{:.0f} días".format(dias) if not np.isnan(dias) else "más días de los observados"
+
+#Cada sección se muestra con su título y una casilla: su contenido solo se
+#calcula si está abierta. La casilla conserva su estado al cambiar de
+#departamento (Streamlit 0.60 no tiene pestañas ni expanders)
+def abrir_seccion(titulo, clave, abierta=False):
+    st.header(titulo)
+    return st.checkbox("Ver sección", abierta, key='seccion_' + clave)
+
+#Instrumentación opcional (tiempo, CPU y memoria por etapa): variable de
+#entorno COVIDCOL_TIMING=1|memoria o ?timing=1 en la URL
+def get_timing_mode():
+    consulta = getattr(st, 'experimental_get_query_params', lambda: {})()
+    return timing.requested(consulta.get('timing', [None])[0])
 
 #Create web-page
-df = get_data()
-df_pais_recuperados = get_data_recuperados(df.copy())
-df_pais_fallecidos = get_data_fallecidos(df.copy())
-df_pais_velocidad_propagacion = get_data_velocidad_propagacion(df.copy())
+etapas = timing.start(get_timing_mode())
+data_dir = get_data_dir()
+version = get_version(data_dir)
+cubo = get_cube(data_dir, version)
+prewarm_figures(version)
+timing.marca('datos')
 
 #Radiobutton con la lista de departamentos o distritos
-lista_depto = sorted(df['Departamento_o_Distrito_'].unique())
+lista_depto = sorted(cubo.deptos)
 lista_depto.insert(0, 'Colombia')
 depto = st.sidebar.radio("Elije el departamento para conocer sus cifras, por defecto se muestra Colombia", lista_depto)
 
-if depto == 'Colombia':
-    df = df.query("Departamento_o_Distrito_!='None'")
-else:
-    df = df.query("Departamento_o_Distrito_==@depto")
-
-
-#Datos descriptivos
-total_casos = df.shape[0]
-recuperados =  df[df['Recuperado']=='Si']['Recuperado'].count()
-fallecidos =  df[df['Falleció']=='Si']['Falleció'].count()
-tasa_recuperados = recuperados / total_casos
-tasa_fallecidos = fallecidos / total_casos
-fecha_reporte_inicial = df['fecha_reporte_web'].min()
-fecha_reporte = df['fecha_reporte_web'].max()
-edad_promedio = df['Edad'].median()
-
-try:
-    edad_mas_casos = df['Edad'].mode()[0]
-except:
-    edad_mas_casos = edad_promedio
-
-edad_maxima = df['Edad'].max()
-total_casos_hombres = df[df['Sexo'] == 'M']['Sexo'].count()
-total_casos_mujeres = df[df['Sexo'] == 'F']['Sexo'].count()
-tasa_casos_hombres = total_casos_hombres / total_casos
-tasa_casos_mujeres = total_casos_mujeres / total_casos
-recuperados_hombres =  df[(df['Recuperado']=='Si')&(df['Sexo']=='M')]['Recuperado'].count()
-recuperados_mujeres = df[(df['Recuperado']=='Si')&(df['Sexo']=='F')]['Recuperado'].count()
-tasa_recuperacion_hombres = recuperados_hombres / recuperados
-tasa_recuperacion_mujeres = recuperados_mujeres / recuperados
-edad_prom_mas_muerte = df[df['Falleció'] == 'Si']['Edad'].median()
-
-try:
-    edad_mas_muerte = df[df['Falleció'] == 'Si']['Edad'].mode()[0]
-except:
-    edad_mas_muerte = edad_prom_mas_muerte
-
-min_dia_tratamiento_recu = df[(df['Recuperado']=='Si')&(df['Días de tratamiento']>0)]['Días de tratamiento'].min()
-max_dia_tratamiento_recu = df[(df['Recuperado']=='Si')&(df['Días de tratamiento']>0)]['Días de tratamiento'].max()
-prom_dia_tratamiento_recu = df[(df['Recuperado']=='Si')&(df['Días de tratamiento']>0)]['Días de tratamiento'].median()
-try:
-    mode_dia_tratamiento_recu = df[(df['Recuperado']=='Si')&(df['Días de tratamiento']>0)]['Días de tratamiento'].mode()[0]
-except:
-    mode_dia_tratamiento_recu = prom_dia_tratamiento_recu
+#Datos descriptivos (calculados para todos los departamentos de una vez)
+k = get_kpis(data_dir, version)[depto]
+timing.marca('kpis')
 
 #Introducción
-st.title("{:,}".format(total_casos) + " Casos positivos COVID-19 en " + depto)
-st.markdown("Reportados al " + fecha_reporte.strftime("%d-%m-%Y") + 
+st.title("{:,}".format(k.total_casos) + " Casos positivos COVID-19 en " + depto)
+st.markdown("Reportados al " + k.fecha_reporte.strftime("%d-%m-%Y") + 
             " por el Instituto Nacional de Salud (INS)." + 
-            " Se han recuperado {:,}".format(recuperados) + " personas, " +
-            " representando cerca del {:.2%}".format(tasa_recuperados) + " de todos los casos." +
-            " El {:.2%}".format(tasa_fallecidos) + " de los casos positivos no lograron recuperarse" +
-            " lo que indica que {:,}".format(fallecidos) + " personas fallecieron por causa del virus.")
+            " Se han recuperado {:,}".format(k.recuperados) + " personas, " +
+            " representando cerca del {:.2%}".format(k.tasa_recuperados) + " de todos los casos." +
+            " El {:.2%}".format(k.tasa_fallecidos) + " de los casos positivos no lograron recuperarse" +
+            " lo que indica que {:,}".format(k.fallecidos) + " personas fallecieron por causa del virus.")
 st.write("""Datos obtenidos desde
 [`datos.gov.co`](https://www.datos.gov.co/Salud-y-Protecci-n-Social/Casos-positivos-de-COVID-19-en-Colombia/gt2j-8ykr/data).""")
+timing.marca('seccion_introduccion')
 
 
 #Sección: Factor de Crecimiento
-
-#dg = df.groupby('fecha_reporte_web')['fecha_reporte_web'].agg(['count'])
-#dg.rename(columns={'count':'Número de casos'}, inplace=True)
-dg = df.groupby([pd.Grouper(key='fecha_reporte_web', freq='W', label='right')])['fecha_reporte_web'].count().to_frame()
-dg.rename(columns={'fecha_reporte_web':'Número de casos'}, inplace=True)
-dg.drop(dg.tail(1).index,inplace=True) #drop last row, incomplete 7D seven days
-dg.drop(dg[dg.index < '2020-03-15'].index, inplace=True)
-dg['Fila Anterior Número de casos'] = dg['Número de casos'].shift()
-dg['Velocidad de Propagación'] = dg['Número de casos'] / dg['Fila Anterior Número de casos']
-vp = dg[dg.index==dg.index.max()]['Velocidad de Propagación'][0]
-
-st.header("¿Qué tan rápido se propaga el virus?")
-st.markdown("El factor de crecimiento o velocidad de propagación del virus es una medida que" +
-            " permite determinar que tan rápido se contagian las personas." + 
-            " Si el número de reproducción es mayor que 1, cada persona infectada transmite " +
-            "la enfermedad al menos a una persona más." + " Para " + depto + 
-            " ese valor es de :  {:.4}".format(vp))
-
-#Initialize Figure
-f = go.Figure()
-
-if depto != 'Colombia':
-    f.add_trace(go.Scatter(x=df_pais_velocidad_propagacion.index,
-                            y=df_pais_velocidad_propagacion['Velocidad de Propagación'],
-                            mode='lines',
-                            name='Colombia'))
-
-f.add_trace(go.Scatter(
-    x=dg.index,
-    y=dg['Velocidad de Propagación'],
-    mode='lines+markers',
-    name=depto
-))
-f.add_shape(
-        # Line Horizontal
-            type="line",
-            x0=dg.index.min(),
-            y0=1,
-            x1=dg.index.max(),
-            y1=1,
-            line=dict(
-                color="green",
-                width=2,
-                dash="solid",
-            ),
-    )
-f.update_xaxes(title="Fecha (semana a semana)")
-f.update_yaxes(title="Velocidad de Propagación")
-st.plotly_chart(f)
+if abrir_seccion("¿Qué tan rápido se propaga el virus?", 'velocidad'):
+    vp = get_velocidad_actual(data_dir, version, depto)
+    st.markdown("El factor de crecimiento o velocidad de propagación del virus es una medida que" +
+                " permite determinar que tan rápido se contagian las personas." + 
+                " Si el número de reproducción es mayor que 1, cada persona infectada transmite " +
+                "la enfermedad al menos a una persona más." + " Para " + depto + 
+                " ese valor es de :  {:.4}".format(vp) +
+                ". Con un promedio de 7 días y el intervalo serial del virus, el número de reproducción" +
+                " efectivo (Rt) estimado es de {:.2f}.".format(get_growth(data_dir, version).latest(depto, 'rt')) +
+                " En la gráfica se puede elegir la serie: promedio de 7 días, factor de crecimiento," +
+                " tiempo de duplicación o Rt.")
+
+    st.plotly_chart(get_figure('velocidad', depto))
+    timing.marca('seccion_velocidad')
 
 #Sección: Afectación Por Departamento o Distrito
-depto_df = pd.crosstab(df['Departamento_o_Distrito_'],df['Recuperado'],
-             margins=True, margins_name='Total Casos', rownames=['Departamento'], colnames=['Recuperado'])
-try:
-    depto_df['% Recuperados'] = (depto_df['Si'] / depto_df['Total Casos']) * 100
-    depto_df.drop('No', axis=1, inplace=True)
-    depto_df.rename(columns={'Si':'Recuperados'}, inplace=True)
-except:
-    pass
-st.header("¿Cuál es la situación por departamento?")
-st.markdown("La siguiente tabla permite visualizar la tasa de recuperación por departamento." +
-            " Los datos pueden ser ordenados según la necesidad, por ejemplo: conocer los departamentos con menos casos.")
-st.dataframe(depto_df)
+if abrir_seccion("¿Cuál es la situación por departamento?", 'departamentos'):
+    st.markdown("La siguiente tabla permite visualizar la tasa de recuperación por departamento." +
+                " Los datos pueden ser ordenados según la necesidad, por ejemplo: conocer los departamentos con menos casos.")
+    st.dataframe(get_recuperados_por_depto(data_dir, version, depto))
+    timing.marca('seccion_departamentos')
+
+#Sección: Filtros (cada cambio solo resta sumas acumuladas, no filtra la tabla).
+#Los filtros aparecen en la barra lateral mientras la sección está abierta
+if abrir_seccion("¿Cómo cambian las cifras con los filtros?", 'filtros'):
+    prefijos = get_prefix(data_dir, version)
+    st.sidebar.subheader("Filtros")
+    primer_dia, ultimo_dia = prefijos.dias[0].date(), prefijos.dias[-1].date()
+    fecha_inicio = st.sidebar.date_input("Desde", primer_dia, min_value=primer_dia, max_value=ultimo_dia)
+    fecha_fin = st.sidebar.date_input("Hasta", ultimo_dia, min_value=primer_dia, max_value=ultimo_dia)
+    filtro_deptos = st.sidebar.multiselect("Departamentos", sorted(prefijos.deptos),
+                                           [] if depto == 'Colombia' else [depto])
+    filtro_sexos = st.sidebar.multiselect("Sexo", cube.SEXOS)
+    filtro_edades = st.sidebar.multiselect("Rango de edad", cube.RANGOS_EDAD)
+    filtro_tipos = st.sidebar.multiselect("Tipo de contagio", prefijos.tipos)
+    filtro_extranjero = st.sidebar.multiselect("Extranjero", prefix.EXTRANJERO)
+
+    filtros = dict(inicio=fecha_inicio, fin=fecha_fin,
+                   deptos=filtro_deptos or None, sexos=filtro_sexos or None, rangos_edad=filtro_edades or None,
+                   tipos=filtro_tipos or None, extranjero=filtro_extranjero or None)
+    filtrado_df = prefijos.window(**filtros)
+    totales = prefijos.totals(**filtros)
+    st.markdown("Entre el " + pd.Timestamp(filtros['inicio']).strftime("%d-%m-%Y") +
+                " y el " + pd.Timestamp(filtros['fin']).strftime("%d-%m-%Y") +
+                " se reportaron {:,} casos con los filtros elegidos,".format(int(totales.sum())) +
+                " de los cuales {:,} se han recuperado y {:,} fallecieron.".format(int(totales['Recuperado']),
+                                                                                int(totales['Fallecido'])))
+    st.plotly_chart(figures.filtrado(filtrado_df))
+    timing.marca('seccion_filtros')
 
 #Sección: Tasa Recuperados
-st.header("¿Cuál es la tasa de recuperación desde el " + fecha_reporte_inicial.strftime("%d-%m-%Y") + "?")
-st.markdown("Al día de hoy en " + depto +
-            " se han recuperado {:,}".format(recuperados) + " personas, " +
-            " representando cerca del {:.2%}".format(tasa_recuperados) + " de todos los casos.")
-recu_df = pd.crosstab(df['fecha_reporte_web'],df['Recuperado'], margins=True,
-                 margins_name='Total', rownames=['Fecha'], colnames=['Recuperado'])
-recu_df['Recuperados Acumulado'] = recu_df['Si'].cumsum()
-recu_df['Total Recuperados Acumulado'] = recu_df['Total'].cumsum()
-recu_df['% Acumulado Recuperados'] = (recu_df['Recuperados Acumulado'] / recu_df['Total Recuperados Acumulado'])*100
-#Initialize Figure
-f = go.Figure()
-
-if depto != 'Colombia':
-    f.add_trace(go.Scatter(x=df_pais_recuperados.index, y=df_pais_recuperados['% Acumulado Recuperados'],
-                    mode='lines',
-                    name='Total Casos Colombia'))
-
-f.add_trace(go.Scatter(x=recu_df.index, y=recu_df['% Acumulado Recuperados'],
-                    mode='lines+markers',
-                    name='Total Casos ' + depto))
-f.update_xaxes(title="Fecha")
-f.update_yaxes(title="% Acumulado Personas Recuperadas")
-st.plotly_chart(f)
+if abrir_seccion("¿Cuál es la tasa de recuperación desde el " + k.fecha_reporte_inicial.strftime("%d-%m-%Y") + "?",
+                 'recuperados'):
+    st.markdown("Al día de hoy en " + depto +
+                " se han recuperado {:,}".format(k.recuperados) + " personas, " +
+                " representando cerca del {:.2%}".format(k.tasa_recuperados) + " de todos los casos.")
+    st.plotly_chart(get_figure('recuperados', depto))
+    timing.marca('seccion_recuperados')
 
 #Sección: Tasa Letalidad
-
-#Sección: Tasa Letalidad
-st.header("¿Cuál es la tasa de letalidad desde el " + fecha_reporte_inicial.strftime("%d-%m-%Y") + "?")
-st.markdown("Al día de hoy en " + depto +
-            " han fallecido {:,}".format(fallecidos) + " personas, " +
-            " representando cerca del {:.2%}".format(tasa_fallecidos) + " de todos los casos.")
-fallecio_df = pd.crosstab(df['fecha_reporte_web'],df['Falleció'], margins=True,
-                margins_name='Total', rownames=['Fecha'], colnames=['Fallecido'])
-try:
-    fallecio_df['Fallecidos Acumulado'] = fallecio_df['Si'].cumsum()
-    fallecio_df['Total Fallecidos Acumulado'] = fallecio_df['Total'].cumsum()
-    fallecio_df['% Acumulado Fallecidos'] = (fallecio_df['Fallecidos Acumulado'] / fallecio_df['Total Fallecidos Acumulado'])*100
-except:
-    fallecio_df['Fallecidos Acumulado'] = 0
-    fallecio_df['Total Fallecidos Acumulado'] = 0
-    fallecio_df['% Acumulado Fallecidos'] = 0
-#Initialize Figure
-f = go.Figure()
-
-if depto != 'Colombia':
-    f.add_trace(go.Scatter(x=df_pais_recuperados.index, y=df_pais_fallecidos['% Acumulado Fallecidos'],
-                    mode='lines',
-                    name='Total Casos Colombia'))
-
-f.add_trace(go.Scatter(x=fallecio_df.index, y=fallecio_df['% Acumulado Fallecidos'],
-                    mode='lines+markers',
-                    name='Total Casos ' + depto))
-
-f.update_xaxes(title="Fecha")
-f.update_yaxes(title="% Acumulado Personas Fallecidas")
-st.plotly_chart(f)
+if abrir_seccion("¿Cuál es la tasa de letalidad desde el " + k.fecha_reporte_inicial.strftime("%d-%m-%Y") + "?",
+                 'fallecidos'):
+    st.markdown("Al día de hoy en " + depto +
+                " han fallecido {:,}".format(k.fallecidos) + " personas, " +
+                " representando cerca del {:.2%}".format(k.tasa_fallecidos) + " de todos los casos.")
+    st.plotly_chart(get_figure('fallecidos', depto))
+    timing.marca('seccion_fallecidos')
 
 #Sección: Distribución Edad
-st.header("¿Cuál es la distribución de casos por edad?")
-st.write("La edad promedio de casos positivos es de {:.0f} años,".format(edad_promedio) + 
-         " sin embargo, se presentaron más casos en personas de {:.0f} años.".format(edad_mas_casos))
-f = px.histogram(df, x="Edad", nbins=15, title=None)
-f.update_xaxes(title="Edad")
-f.update_yaxes(title="Casos positivos")
-st.plotly_chart(f)
+if abrir_seccion("¿Cuál es la distribución de casos por edad?", 'edad'):
+    st.write("La edad promedio de casos positivos es de {:.0f} años,".format(k.edad_promedio) + 
+             " sin embargo, se presentaron más casos en personas de {:.0f} años.".format(k.edad_mas_casos))
+    st.plotly_chart(get_figure('edad', depto))
+    timing.marca('seccion_edad')
 
 #Sección: Crecimiento Casos
-
-st.header("¿Cuál es el comportamiento de casos por sexo?")
-st.write("De los {:,} casos positivos, ".format(total_casos) + 
-         " el {:.2%} son del sexo masculino y ".format(tasa_casos_hombres) + 
-         "{:.2%} del femenino.".format(tasa_casos_mujeres))
-st.subheader("Tasa de recuperación")
-st.write("De los {:,} casos recuperados, ".format(recuperados) + 
-         " el {:.2%} son del sexo masculino y ".format(tasa_recuperacion_hombres) + 
-         "{:.2%} del femenino.".format(tasa_recuperacion_mujeres) + 
-         " Esto es {:,} hombres y {:,} mujeres recuperados.".format(recuperados_hombres, recuperados_mujeres))
-
-#Initialize Figure
-f = go.Figure()
-
-# Add traces
-#Total Casos
-dg = df.groupby('fecha_reporte_web')['fecha_reporte_web'].agg(['count'])
-dg.rename(columns={'count':'Número de casos'}, inplace=True)
-f.add_trace(go.Scatter(x=dg.index, y=dg['Número de casos'],
-                    mode='lines+markers',
-                    name='Total Casos'))
-#Total Casos : Mujeres
-dg = df[df['Sexo'] == 'F'].groupby('fecha_reporte_web')['fecha_reporte_web'].agg(['count'])
-dg.rename(columns={'count':'Número de casos'}, inplace=True)
-f.add_trace(go.Scatter(x=dg.index, y=dg['Número de casos'],
-                    mode='lines',
-                    name='Femenino'))
-
-#Total Casos : Hombres
-dg = df[df['Sexo'] == 'M'].groupby('fecha_reporte_web')['fecha_reporte_web'].agg(['count'])
-dg.rename(columns={'count':'Número de casos'}, inplace=True)
-f.add_trace(go.Scatter(x=dg.index, y=dg['Número de casos'],
-                    mode='lines',
-                    name='Masculino'))
-
-f.update_xaxes(title="Fecha")
-f.update_yaxes(title="#. de casos")
-st.plotly_chart(f)
+if abrir_seccion("¿Cuál es el comportamiento de casos por sexo?", 'sexo'):
+    st.write("De los {:,} casos positivos, ".format(k.total_casos) + 
+             " el {:.2%} son del sexo masculino y ".format(k.tasa_casos_hombres) + 
+             "{:.2%} del femenino.".format(k.tasa_casos_mujeres))
+    st.subheader("Tasa de recuperación")
+    st.write("De los {:,} casos recuperados, ".format(k.recuperados) + 
+             " el {:.2%} son del sexo masculino y ".format(k.tasa_recuperacion_hombres) + 
+             "{:.2%} del femenino.".format(k.tasa_recuperacion_mujeres) + 
+             " Esto es {:,} hombres y {:,} mujeres recuperados.".format(k.recuperados_hombres, k.recuperados_mujeres))
+
+    st.plotly_chart(get_figure('sexo', depto))
+    timing.marca('seccion_sexo')
 
 #Sección: Relación Edad y Muertes
-st.header("¿Cuál es la relación entre la edad y las muertes?")
-st.write("Para los {:,} casos positivos, ".format(total_casos) + 
-         " la edad promedio de facellimiento es de {:.0f} años,".format(edad_prom_mas_muerte) + 
-         " si embargo, la mayoria de casos ocurre a los {:.0f} años de edad.".format(edad_mas_muerte))
-st.subheader("Duración tratamiento con recuperación satisfactoria")
-st.write("De los {:,} casos recuperados, ".format(recuperados) + 
-         " el tratamiento esta entre {:.0f} y {:.0f} días.".format(min_dia_tratamiento_recu, max_dia_tratamiento_recu) + 
-         " En promedio las personas contagiadas se recuperan a los {:.0f} dias, ".format(prom_dia_tratamiento_recu) +
-         " sin embargo, la mayoría de los casos se recuperan aproximadamente en {:.0f} días.".format(mode_dia_tratamiento_recu))
-
-f = px.scatter(df[(df['Edad'] > 0)&(df['Días de tratamiento'] > 0)], 
-                x="Edad", y="Días de tratamiento", color='Falleció')
-st.plotly_chart(f)
+if abrir_seccion("¿Cuál es la relación entre la edad y las muertes?", 'edad_tratamiento'):
+    st.write("Para los {:,} casos positivos, ".format(k.total_casos) + 
+             " la edad promedio de facellimiento es de {:.0f} años,".format(k.edad_prom_mas_muerte) + 
+             " si embargo, la mayoria de casos ocurre a los {:.0f} años de edad.".format(k.edad_mas_muerte))
+    st.subheader("Duración tratamiento con recuperación satisfactoria")
+    recuperacion = get_survival(data_dir, version).observed(depto, 'Recuperado')
+    st.write("De los {:,} casos recuperados con fecha de recuperación, ".format(int(recuperacion['casos'])) + 
+             " el tratamiento esta entre {:.0f} y {:.0f} días.".format(recuperacion['min'], recuperacion['max']) + 
+             " En promedio las personas contagiadas se recuperan a los {:.0f} dias, ".format(recuperacion['mediana']) +
+             " sin embargo, la mayoría de los casos se recuperan aproximadamente en {:.0f} días.".format(recuperacion['moda']))
+
+    st.plotly_chart(get_figure('edad_tratamiento', depto))
+    timing.marca('seccion_edad_tratamiento')
+
+#Sección: Tiempo hasta la recuperación o la muerte
+if abrir_seccion("¿Cuánto tarda la recuperación?", 'supervivencia'):
+    supervivencia = get_survival(data_dir, version)
+    cuantiles = supervivencia.quantiles(depto, 'Recuperado').map(formato_dias)
+    st.markdown("Contando desde el inicio de síntomas, en " + depto + " la mitad de los casos se recupera" +
+                " en " + cuantiles[0.5] + "; el 25% en " + cuantiles[0.25] + " y el 75% en " + cuantiles[0.75] + "." +
+                " Las curvas de Kaplan-Meier incluyen los casos activos hasta la fecha de corte" +
+                " y en el menú se puede ver el tiempo hasta la muerte.")
+    st.plotly_chart(get_figure('supervivencia', depto))
+    st.subheader("Días hasta la recuperación por rango de edad (cuantiles 25%, 50% y 75%)")
+    st.dataframe(supervivencia.quantiles_by_age(depto, 'Recuperado'))
+    timing.marca('seccion_supervivencia')
+
+#Sección: Modelo SIR
+if abrir_seccion("¿Qué proyecta un modelo SIR?", 'sir'):
+    ajuste = get_ajuste_sir(data_dir, version, depto)
+    st.markdown("El modelo SIR divide la población en susceptibles, infectados y recuperados." +
+                " Ajustando sus parámetros a los casos reportados en " + depto +
+                " se obtiene una tasa de contagio de {:.3f} y de recuperación de {:.3f},".format(ajuste.beta, ajuste.gamma) +
+                " es decir, un número básico de reproducción R0 de {:.2f}.".format(ajuste.beta / ajuste.gamma) +
+                " La gráfica muestra el ajuste y su proyección a 30 días.")
+    st.plotly_chart(get_figure('sir', depto))
+    timing.marca('seccion_sir')
+
+#Sección: Municipios (solo para un departamento). El municipio se elige en la
+#barra lateral mientras la sección está abierta
+if depto != 'Colombia' and abrir_seccion("¿Cómo están los municipios de " + depto + "?", 'municipios'):
+    ciudades_df = get_ciudades(data_dir, version, depto)
+    nombres_municipio = dict(zip(ciudades_df['Código'], ciudades_df['Municipio']))
+    municipio = st.sidebar.selectbox("Municipio", [None] + ciudades_df['Código'].tolist(),
+                                     format_func=lambda c: 'Todos' if c is None else nombres_municipio[c])
+    st.markdown("Casos, recuperados y fallecidos por municipio.")
+    st.dataframe(ciudades_df[['Municipio', 'Casos', 'Recuperados', 'Fallecidos']].set_index('Municipio'))
+    st.plotly_chart(figures.municipios(ciudades_df))
+    if municipio is not None:
+        nombre = nombres_municipio[municipio]
+        totales_municipio, edad_municipio, serie_municipio = get_municipio(data_dir, version, depto, municipio)
+        st.subheader(nombre)
+        st.markdown("En " + nombre + " hay {:,} casos positivos,".format(int(totales_municipio.sum())) +
+                    " {:,} recuperados y {:,} fallecidos.".format(int(totales_municipio['Recuperado']),
+                                                                  int(totales_municipio['Fallecido'])) +
+                    " La edad promedio de los casos es de {:.0f} años.".format(edad_municipio))
+        st.plotly_chart(figures.municipio(serie_municipio, nombre))
+    timing.marca('seccion_municipios')
 
 #Mapa
-st.header("Dónde estan ubicados?")
-st.subheader("Mapa casos positivos")
-st.markdown("El siguiente mapa muestra los departamentos con casos positivos")
-
-st.map(df[df['lat'].notnull()][['lat','lon']])
\ No newline at end of file
+if abrir_seccion("Dónde estan ubicados?", 'mapa'):
+    st.subheader("Mapa casos positivos")
+    st.markdown("El siguiente mapa muestra los departamentos con casos positivos")
+
+    st.plotly_chart(get_figure('mapa', depto))
+    timing.marca('seccion_mapa')
+
+#Tiempos de esta ejecución: una línea JSON (COVIDCOL_TIMING_LOG o stdout) y
+#una tabla en la barra lateral
+if etapas is not None:
+    etapas.to_jsonl(os.environ.get(timing.ENV_LOG), depto=depto, version=version)
+    if st.sidebar.checkbox("Ver tiempos por etapa (debug)"):
+        st.sidebar.table(pd.DataFrame(etapas.resumen()).set_index('etapa').round(3))
+    timing.activa(None)
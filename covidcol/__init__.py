@@ -0,0 +1 @@
+#Paquete con el procesamiento de datos del tablero covid-col-streamlit
@@ -0,0 +1,102 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from covidcol import store
+
+#Agregados para las vistas que antes enviaban un punto por caso al
+#navegador: el tamaño de estas tablas no crece con el número de casos.
+#Se guardan junto a la tabla (y en cada versión publicada) para que la
+#página no tenga que abrir la tabla para construirlos
+AGGREGATES_FILE = 'agregados.npz'
+
+Agregados = namedtuple('Agregados', ['edades', 'edad_tratamiento', 'casos_por_depto', 'version'])
+TABLAS = ['edades', 'edad_tratamiento', 'casos_por_depto']
+
+
+#Conteo de casos por departamento x edad x días de tratamiento x falleció
+#(solo Edad > 0 y Días de tratamiento > 0, como el scatter original)
+def edad_tratamiento(df):
+    mascara = ((df['Edad'] > 0) & (df['Días de tratamiento'] > 0)).to_numpy()
+    cod_depto, deptos = pd.factorize(df['Departamento_o_Distrito_'], sort=True)
+    cod_depto = cod_depto[mascara]
+    edad = df['Edad'].to_numpy()[mascara].astype(np.int64)
+    dias = df['Días de tratamiento'].to_numpy()[mascara].astype(np.int64)
+    fallecio = df['Falleció'].to_numpy(dtype=bool)[mascara].astype(np.int64)
+
+    forma = (len(deptos), int(edad.max(initial=0)) + 1, int(dias.max(initial=0)) + 1, 2)
+    plano = np.ravel_multi_index((cod_depto, edad, dias, fallecio), forma)
+    conteos = np.bincount(plano, minlength=int(np.prod(forma)))
+
+    celdas = np.flatnonzero(conteos)
+    i_depto, i_edad, i_dias, i_fallecio = np.unravel_index(celdas, forma)
+    return pd.DataFrame({
+        'Departamento': np.asarray(deptos)[i_depto],
+        'Edad': i_edad,
+        'Días de tratamiento': i_dias,
+        'Falleció': np.where(i_fallecio == 1, 'Si', 'No'),
+        'Casos': conteos[celdas],
+    })
+
+
+#Suma las celdas de los departamentos para la vista nacional
+def edad_tratamiento_depto(agregado, depto):
+    if depto == 'Colombia':
+        return agregado.groupby(['Edad', 'Días de tratamiento', 'Falleció'], as_index=False)['Casos'].sum()
+    return agregado[agregado['Departamento'] == depto]
+
+
+#Un punto por departamento con su número de casos (las coordenadas vienen
+#de departamentos_geocode_lat_lon.csv, iguales para todos sus casos)
+def casos_por_depto(df):
+    dg = df[df['lat'].notnull()].groupby('Departamento_o_Distrito_', observed=True).agg(
+        lat=('lat', 'first'), lon=('lon', 'first'), Casos=('lat', 'size'))
+    dg.index.name = 'Departamento'
+    return dg.reset_index()
+
+
+#Casos por departamento x edad para el histograma de edades
+def edades(df):
+    dg = df.groupby(['Departamento_o_Distrito_', 'Edad'], observed=True).size()
+    dg = dg[dg > 0].rename('Casos').reset_index()
+    return dg.rename(columns={'Departamento_o_Distrito_': 'Departamento'})
+
+
+def edades_depto(agregado, depto):
+    if depto == 'Colombia':
+        return agregado.groupby('Edad', as_index=False)['Casos'].sum()
+    return agregado[agregado['Departamento'] == depto]
+
+
+def build_aggregates(df, version=None):
+    return Agregados(edades(df), edad_tratamiento(df), casos_por_depto(df), version)
+
+
+#Una entrada 'tabla/columna' por columna; el texto (y las categorías) como str
+def save_aggregates(agregados, path):
+    columnas = {}
+    for tabla in TABLAS:
+        for col, serie in getattr(agregados, tabla).items():
+            valores = serie.to_numpy()
+            columnas[tabla + '/' + col] = valores.astype(str) if valores.dtype == object else valores
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, version=np.array(agregados.version or '', dtype=str), **columnas)
+    os.replace(tmp, path)
+
+
+def load_aggregates(path):
+    with np.load(path, allow_pickle=False) as z:
+        tablas = {tabla: {} for tabla in TABLAS}
+        for nombre in z.files:
+            if '/' in nombre:
+                tabla, col = nombre.split('/', 1)
+                tablas[tabla][col] = z[nombre]
+        return Agregados(*[pd.DataFrame(tablas[tabla]) for tabla in TABLAS], str(z['version']))
+
+
+#Agregados de la versión actual de la tabla en cache, se guardan junto a ella
+def load_or_build(df, cache_dir=store.CACHE_DIR):
+    return store.load_or_build_derived(cache_dir, AGGREGATES_FILE, load_aggregates,
+                                       lambda version: build_aggregates(store.table(df), version), save_aggregates)
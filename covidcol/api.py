@@ -0,0 +1,302 @@
+import gzip
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+from covidcol import cube, growth, kpis, precompute, refresh, store, survival
+
+#API de solo lectura con las mismas cifras de la página, servidas desde los
+#agregados ya calculados (última versión publicada o el cache local). Cada
+#respuesta se serializa (y comprime) una vez por versión de datos; el ETag es
+#la versión, así que un cliente con la versión vigente recibe un 304 vacío.
+#Se puede correr con la librería estándar (python -m covidcol.api) o con un
+#servidor ASGI (uvicorn covidcol.api:asgi)
+
+#Cada cuánto se revisa si hay una versión nueva publicada (segundos)
+REVISION = 5
+#Respuestas más pequeñas que esto no se comprimen
+MIN_GZIP = 512
+
+
+#Datos de una versión: cubo (mmap) y cifras precalculadas por departamento.
+#Los derivados que falten (p.ej. el cache local recién actualizado, antes de
+#que alguien abra la página) se construyen y se guardan como en la página; la
+#tabla solo se carga si hace falta y una sola vez
+class Datos:
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        #El enlace del cache local se resuelve una vez: todo sale de la misma versión
+        directorio = os.path.realpath(data_dir)
+        tabla = _lazy_table(directorio)
+        self.cubo = cube.load_or_build(tabla, directorio)
+        self.version = self.cubo.version
+        self.resultados = precompute.load_results(directorio)
+        if self.resultados is None:
+            #Sin precálculo: las cifras salen de la tabla en cache, una vez por versión
+            todos = kpis.compute_kpis(tabla())
+            self.resultados = {depto: {'kpis': k, 'velocidad_propagacion': None, 'sir': None}
+                               for depto, k in todos.items()}
+        self.deptos = ['Colombia'] + sorted(self.cubo.deptos)
+        self.crecimiento = growth.load_or_build(self.cubo, directorio)
+        self.supervivencia = survival.load_or_build(tabla, directorio)
+
+
+def _lazy_table(directorio):
+    tabla = []
+
+    def cargar():
+        if not tabla:
+            tabla.append(store.load_table(directorio))
+        return tabla[0]
+    return cargar
+
+
+_datos = None
+_revisado = 0
+_lock = threading.Lock()
+
+
+def _data_dir():
+    return refresh.current_dir() or store.CACHE_DIR
+
+
+#Datos de la versión vigente; cambia a una versión nueva sin reiniciar. Si
+#el directorio todavía no tiene manifiesto (el cache local sin construir) se
+#siguen sirviendo los datos actuales, o None si aún no hay ninguno
+def current():
+    global _datos, _revisado
+    with _lock:
+        if _datos is None or time.monotonic() - _revisado > REVISION:
+            data_dir = _data_dir()
+            manifest = store.read_manifest(data_dir)
+            if manifest is not None and (_datos is None or _datos.data_dir != data_dir or
+                                         manifest['version'] != _datos.version):
+                _datos = Datos(data_dir)
+                _cuerpo.cache_clear()
+            _revisado = time.monotonic()
+        return _datos
+
+
+def _valor(valor):
+    if isinstance(valor, pd.Timestamp):
+        return None if pd.isnull(valor) else valor.strftime('%Y-%m-%d')
+    if isinstance(valor, (np.integer, np.floating)):
+        valor = valor.item()
+    if isinstance(valor, float) and np.isnan(valor):
+        return None
+    return valor
+
+
+def _tupla(t):
+    return None if t is None else {k: _valor(v) for k, v in t._asdict().items()}
+
+
+def _resumen(depto, r):
+    k = r['kpis']
+    return {
+        'departamento': depto,
+        'total_casos': _valor(k.total_casos),
+        'recuperados': _valor(k.recuperados),
+        'fallecidos': _valor(k.fallecidos),
+        'tasa_recuperados': _valor(k.tasa_recuperados),
+        'tasa_fallecidos': _valor(k.tasa_fallecidos),
+        'fecha_reporte': _valor(k.fecha_reporte),
+        'velocidad_propagacion': _valor(r['velocidad_propagacion']),
+    }
+
+
+def _serie(serie):
+    return {'fechas': [d.strftime('%Y-%m-%d') for d in serie.index],
+            'valores': [_valor(v) for v in serie.to_numpy()]}
+
+
+def _deptos(datos):
+    return {'version': datos.version,
+            'departamentos': [_resumen(d, datos.resultados[d]) for d in datos.deptos]}
+
+
+def _depto(datos, depto):
+    r = datos.resultados[depto]
+    return dict(_resumen(depto, r), version=datos.version, kpis=_tupla(r['kpis']), sir=_tupla(r['sir']))
+
+
+#Velocidad de propagación semanal (casos de la semana / casos de la anterior)
+def _velocidad(datos, depto):
+    dg = cube.velocidad_propagacion(datos.cubo, depto)
+    return dict(_serie(dg['Velocidad de Propagación']), casos=[_valor(v) for v in dg['Número de casos']],
+                departamento=depto, version=datos.version)
+
+
+#Casos diarios por sexo (fecha de reporte web)
+def _sexo(datos, depto):
+    serie = cube.trim(datos.cubo.series(depto))
+    respuesta = {'departamento': depto, 'version': datos.version,
+                 'fechas': [d.strftime('%Y-%m-%d') for d in serie.index]}
+    for sexo in cube.SEXOS:
+        respuesta[sexo] = datos.cubo.series(depto, sexo=sexo).loc[serie.index].tolist()
+    return respuesta
+
+
+#Casos, recuperados y fallecidos diarios
+def _diario(datos, depto):
+    serie = cube.trim(datos.cubo.series(depto))
+    respuesta = {'departamento': depto, 'version': datos.version,
+                 'fechas': [d.strftime('%Y-%m-%d') for d in serie.index], 'casos': serie.tolist()}
+    for resultado in ('Recuperado', 'Fallecido'):
+        respuesta[resultado.lower() + 's'] = datos.cubo.series(depto, resultado=resultado).loc[serie.index].tolist()
+    return respuesta
+
+
+#Promedio 7 días, factor de crecimiento, tiempo de duplicación y Rt diarios
+def _crecimiento(datos, depto):
+    dg = datos.crecimiento.frame(depto)
+    respuesta = {'departamento': depto, 'version': datos.version,
+                 'fechas': [d.strftime('%Y-%m-%d') for d in dg.index]}
+    for metrica in growth.METRICAS:
+        respuesta[metrica] = [_valor(v) for v in dg[metrica].to_numpy()]
+    return respuesta
+
+
+#Cuantiles de días hasta la recuperación y hasta la muerte por rango de edad
+def _supervivencia(datos, depto):
+    respuesta = {'departamento': depto, 'version': datos.version, 'cuantiles': survival.CUANTILES}
+    for desenlace in survival.DESENLACES:
+        dg = datos.supervivencia.quantiles_by_age(depto, desenlace)
+        respuesta[desenlace.lower()] = {rango: [_valor(v) for v in fila] for rango, fila in zip(dg.index, dg.to_numpy())}
+    return respuesta
+
+
+RUTAS_DEPTO = {
+    '': _depto,
+    'velocidad': _velocidad,
+    'sexo': _sexo,
+    'diario': _diario,
+    'crecimiento': _crecimiento,
+    'supervivencia': _supervivencia,
+}
+
+
+#Cuerpo JSON (y su versión gzip) de una ruta; None si la ruta no existe.
+#Se memoriza por objeto Datos, es decir por versión
+@lru_cache(maxsize=1024)
+def _cuerpo(datos, ruta):
+    partes = [unquote(p) for p in ruta.strip('/').split('/')]
+    if partes[:1] != ['api']:
+        return None
+    partes = partes[1:]
+    if partes == ['version']:
+        respuesta = {'version': datos.version}
+    elif partes == ['deptos']:
+        respuesta = _deptos(datos)
+    elif len(partes) in (2, 3) and partes[0] == 'deptos' and partes[1] in datos.resultados:
+        construir = RUTAS_DEPTO.get(partes[2] if len(partes) == 3 else '')
+        if construir is None:
+            return None
+        respuesta = construir(datos, partes[1])
+    else:
+        return None
+    cuerpo = json.dumps(respuesta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    comprimido = gzip.compress(cuerpo, 6) if len(cuerpo) >= MIN_GZIP else None
+    return cuerpo, comprimido
+
+
+def _etag_match(if_none_match, version):
+    for etag in (if_none_match or '').split(','):
+        etag = etag.strip()
+        if etag == '*':
+            return True
+        etag = etag[2:] if etag.startswith('W/') else etag
+        if etag.strip('"').split('-gz')[0] == version:
+            return True
+    return False
+
+
+#Atiende una petición: devuelve (status, cabeceras, cuerpo). Las cabeceras
+#de la petición van en minúsculas
+def handle(metodo, ruta, cabeceras):
+    if metodo not in ('GET', 'HEAD'):
+        return 405, [('Allow', 'GET, HEAD')], b''
+    datos = current()
+    if datos is None:
+        return 503, [('Content-Type', 'application/json'), ('Retry-After', str(REVISION))], \
+            b'{"error":"datos no disponibles"}'
+    ruta = ruta.split('?', 1)[0]
+    encontrado = _cuerpo(datos, ruta)
+    if encontrado is None:
+        return 404, [('Content-Type', 'application/json')], b'{"error":"no encontrado"}'
+
+    cuerpo, comprimido = encontrado
+    usar_gzip = comprimido is not None and 'gzip' in cabeceras.get('accept-encoding', '')
+    respuesta = [('ETag', '"{}{}"'.format(datos.version, '-gz' if usar_gzip else '')),
+                 ('Cache-Control', 'no-cache'), ('Vary', 'Accept-Encoding')]
+    if _etag_match(cabeceras.get('if-none-match'), datos.version):
+        return 304, respuesta, b''
+
+    if usar_gzip:
+        cuerpo = comprimido
+        respuesta.append(('Content-Encoding', 'gzip'))
+    respuesta += [('Content-Type', 'application/json; charset=utf-8'), ('Content-Length', str(len(cuerpo)))]
+    return 200, respuesta, b'' if metodo == 'HEAD' else cuerpo
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _responder(self):
+        cabeceras = {k.lower(): v for k, v in self.headers.items()}
+        status, respuesta, cuerpo = handle(self.command, self.path, cabeceras)
+        self.send_response(status)
+        for k, v in respuesta:
+            self.send_header(k, v)
+        if status != 200:
+            self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    do_GET = _responder
+    do_HEAD = _responder
+
+    def log_message(self, formato, *args):
+        pass
+
+
+#Aplicación ASGI con el mismo handle()
+async def asgi(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    cabeceras = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+    status, respuesta, cuerpo = handle(scope['method'], scope['path'], cabeceras)
+    if status != 200:
+        respuesta = respuesta + [('Content-Length', str(len(cuerpo)))]
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in respuesta]})
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+def serve(host='127.0.0.1', port=8000):
+    current()
+    servidor = ThreadingHTTPServer((host, port), Handler)
+    servidor.daemon_threads = True
+    try:
+        servidor.serve_forever()
+    finally:
+        servidor.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='API JSON de solo lectura con las cifras por departamento')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    print('API en http://{}:{}/api/deptos'.format(args.host, args.port), flush=True)
+    serve(args.host, args.port)
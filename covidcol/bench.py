@@ -0,0 +1,307 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from covidcol import aggregate, cube, data as datos, figcache, figures, growth, kpis, store, survival, timing
+
+#Benchmark del pipeline completo con CSV sintéticos con la forma del CSV del
+#INS (mismas columnas, separador ';', formato de fechas), sin acceso a
+#datos.gov.co. Cada tamaño corre en su propio proceso para que la memoria
+#máxima (RSS) sea solo la de ese tamaño
+BENCH_DIR = 'dataset/bench'
+TAMANOS = [100000, 1000000, 10000000]
+BLOQUE = 500000
+#Casos nuevos del corte siguiente, como fracción de los del corte medido
+NUEVOS = 0.01
+
+#Peso aproximado de cada departamento en los casos (corte de junio de 2020);
+#los que no aparecen comparten un peso pequeño
+PESOS_DEPTO = {
+    'Bogotá D.C.': 0.30, 'Barranquilla D.E.': 0.09, 'Cartagena D.T. y C.': 0.09,
+    'Valle del Cauca': 0.09, 'Atlántico': 0.06, 'Antioquia': 0.04, 'Nariño': 0.04,
+    'Amazonas': 0.03, 'Cundinamarca': 0.03, 'Meta': 0.02, 'Chocó': 0.02,
+    'Santa Marta D.T. y C.': 0.02, 'Bolívar': 0.02, 'Magdalena': 0.01,
+    'Buenaventura D.E.': 0.01, 'Sucre': 0.01, 'Córdoba': 0.01,
+}
+PESO_OTROS = 0.004
+
+#Día del primer caso y días de la epidemia simulada
+INICIO = np.datetime64('2020-03-06')
+DIAS = 120
+
+
+#Departamentos con su peso y los códigos DIVIPOLA de sus municipios (los
+#distritos usan los municipios de su departamento, p.ej. Cartagena -> Bolívar)
+def _municipios(cod_divipola, deptos):
+    padre = {'Barranquilla D.E.': 'Atlántico', 'Cartagena D.T. y C.': 'Bolívar',
+             'Santa Marta D.T. y C.': 'Magdalena', 'Buenaventura D.E.': 'Valle del Cauca',
+             'Bogotá D.C.': 'Bogotá, D.C.', 'Quindío': 'Quindio',
+             'Archipiélago de San Andrés Providencia y Santa Catalina':
+                 'Archipiélago de San Andrés, Providencia y Santa Catalina'}
+    municipios = []
+    for depto in deptos:
+        filas = cod_divipola[cod_divipola['DEPARTAMENTO'] == padre.get(depto, depto)]
+        if not len(filas):
+            filas = cod_divipola.iloc[:1]
+        municipios.append((filas['CODIGO'].to_numpy(), filas['MUNICIPIO'].to_numpy(dtype=object)))
+    return municipios
+
+
+def _fechas(valores):
+    return pd.Series(valores).dt.strftime('%Y-%m-%dT00:00:00.000')
+
+
+def _bloque(rng, primero, n, deptos, pesos, municipios):
+    i_depto = rng.choice(len(deptos), n, p=pesos)
+    codigo = np.empty(n, dtype=np.int64)
+    ciudad = np.empty(n, dtype=object)
+    for i in np.unique(i_depto):
+        mascara = i_depto == i
+        codigos, nombres = municipios[i]
+        j = rng.integers(0, len(codigos), mascara.sum())
+        codigo[mascara], ciudad[mascara] = codigos[j], nombres[j]
+    depto = np.asarray(deptos, dtype=object)[i_depto]
+    #Algunos casos sin departamento, se corrigen con el código DIVIPOLA
+    depto[rng.random(n) < 0.01] = None
+
+    #Casos que crecen exponencialmente durante la epidemia
+    r = np.log(200) / DIAS
+    dia = np.log1p(rng.random(n) * np.expm1(r * DIAS)) / r
+    reporte = INICIO + dia.astype('timedelta64[D]')
+    fis = reporte - rng.poisson(6, n).astype('timedelta64[D]')
+
+    edad = np.clip(rng.normal(39, 18, n), 0, 100).astype(np.int64)
+    #Recuperados según los días desde el reporte, fallecidos según la edad
+    dias_restantes = DIAS - dia
+    p_muerte = 0.002 + 0.0015 * np.maximum(edad - 40, 0)
+    u = rng.random(n)
+    atencion = np.where(u < p_muerte, 'Fallecido',
+                        np.where(rng.random(n) < np.clip(dias_restantes / 30, 0, 0.95), 'Recuperado',
+                                 rng.choice(['Casa', 'Hospital', 'Hospital UCI'], n, p=[0.85, 0.11, 0.04])))
+    fallecido = atencion == 'Fallecido'
+    recuperado = atencion == 'Recuperado'
+    muerte = np.where(fallecido, reporte + rng.gamma(2, 4, n).astype('timedelta64[D]'), np.datetime64('NaT'))
+    recuperacion = np.where(recuperado, reporte + rng.gamma(7, 2, n).astype('timedelta64[D]'), np.datetime64('NaT'))
+
+    estado = np.where(fallecido, 'Fallecido',
+                      rng.choice(['Leve', 'leve', 'Moderado', 'Grave', 'Asintomático'], n,
+                                 p=[0.6, 0.05, 0.08, 0.02, 0.25]))
+    fis_texto = _fechas(fis)
+    fis_texto[estado == 'Asintomático'] = 'Asintomático'
+
+    return pd.DataFrame({
+        'ID de caso': np.arange(primero, primero + n),
+        'Fecha de notificación': _fechas(fis),
+        'Código DIVIPOLA': codigo,
+        'Ciudad de ubicación': ciudad,
+        'Departamento o Distrito ': depto,
+        'atención': atencion,
+        'Edad': edad,
+        'Sexo': rng.choice(['M', 'F', 'f', 'm'], n, p=[0.5, 0.47, 0.02, 0.01]),
+        'Tipo': rng.choice(['Relacionado', 'En estudio', 'Importado'], n, p=[0.45, 0.5, 0.05]),
+        'Estado': estado,
+        'País de procedencia': rng.choice(['Colombia', 'Venezuela', 'España', 'Estados Unidos'], n,
+                                          p=[0.96, 0.02, 0.01, 0.01]),
+        'FIS': fis_texto,
+        'Fecha de muerte': _fechas(muerte),
+        'Fecha diagnostico': _fechas(reporte),
+        'Fecha recuperado': _fechas(recuperacion),
+        'fecha reporte web': _fechas(reporte),
+        'Tipo recuperación': np.where(recuperado, rng.choice(['PCR', 'Tiempo'], n), None),
+    })
+
+
+#CSV sintético de 'filas' casos (ids desde 'primero'), escrito por bloques.
+#Con la misma semilla siempre sale el mismo archivo
+def synthetic_csv(path, filas, seed=0, fuentes=None, primero=1):
+    fuentes = fuentes or datos.FUENTES
+    cod_divipola = pd.read_excel(fuentes[1])
+    deptos = pd.read_csv(fuentes[2])['Departamento'].tolist()
+    pesos = np.array([PESOS_DEPTO.get(d, PESO_OTROS) for d in deptos])
+    pesos /= pesos.sum()
+    municipios = _municipios(cod_divipola, deptos)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    for i, inicio in enumerate(range(0, filas, BLOQUE)):
+        rng = np.random.default_rng([seed, i])
+        bloque = _bloque(rng, primero + inicio, min(BLOQUE, filas - inicio), deptos, pesos, municipios)
+        bloque.to_csv(tmp, sep=';', index=False, header=(i == 0), mode='w' if i == 0 else 'a')
+    os.replace(tmp, path)
+    return path
+
+
+#Corte siguiente de un CSV sintético de 'filas' casos: los mismos casos y
+#'nuevos' casos más al final, como el archivo del INS del día después
+def next_csv(csv, path, filas, nuevos, seed=0, fuentes=None):
+    extra = synthetic_csv(path + '.nuevos', nuevos, seed + 1, fuentes, primero=filas + 1)
+    tmp = path + '.tmp'
+    shutil.copyfile(csv, tmp)
+    with open(extra, 'rb') as origen, open(tmp, 'ab') as destino:
+        origen.readline()
+        shutil.copyfileobj(origen, destino)
+    os.remove(extra)
+    os.replace(tmp, path)
+    return path
+
+
+def synthetic_path(filas, seed=0, bench_dir=BENCH_DIR, siguiente=False):
+    return os.path.join(bench_dir, 'casos-{}-{}{}.csv'.format(filas, seed, '-siguiente' if siguiente else ''))
+
+
+#Corre todas las etapas sobre un CSV y devuelve el tiempo/memoria de cada una.
+#La tabla limpia se construye como en la aplicación (store.update) en un cache
+#temporal y, si hay un corte siguiente, se actualiza con él por id de caso
+def run_stages(csv, fuentes=None, memoria=False, depto=None, siguiente=None):
+    fuentes = fuentes or datos.FUENTES
+    etapas = timing.start('memoria' if memoria else '1')
+    #Hermano del CSV para poder enlazarlo (mismo disco) en lugar de copiarlo
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(csv))) as directorio:
+        casos = os.path.join(directorio, 'casos.csv')
+        cache_dir = os.path.join(directorio, 'cache')
+        os.link(csv, casos)
+        etapas.reinicia()
+        return _run_stages(etapas, casos, cache_dir, [casos] + fuentes[1:], memoria, depto, siguiente)
+
+
+def _run_stages(etapas, casos, cache_dir, fuentes, memoria, depto, siguiente):
+    #Las etapas internas de store (una por bloque del CSV) no se marcan: cada
+    #actualización es una sola etapa
+    timing.activa(None)
+    store.update(cache_dir, fuentes)
+    etapas.marca('construccion', filas=store.read_manifest(cache_dir)['filas'])
+    if siguiente:
+        #El CSV del INS se reemplaza en su lugar con el corte siguiente
+        os.link(siguiente, casos + '.tmp')
+        os.replace(casos + '.tmp', casos)
+        etapas.reinicia()
+        store.update(cache_dir, fuentes)
+        etapas.marca('upsert_corte', filas=store.read_manifest(cache_dir)['filas'])
+    timing.activa(etapas)
+
+    df = store.load_table(cache_dir)
+    cubo = cube.build_cube(df, 'bench')
+    etapas.marca('cubo')
+    todos = kpis.compute_kpis(df)
+    etapas.marca('kpis')
+    fuentes_figuras = figures.Fuentes(cubo=cubo, edades=aggregate.edades(df),
+                                      edad_tratamiento=aggregate.edad_tratamiento(df),
+                                      casos_por_depto=aggregate.casos_por_depto(df),
+                                      crecimiento=growth.build_growth(cubo),
+                                      supervivencia=survival.build_survival(df, 'bench'))
+    etapas.marca('agregados')
+
+    #Una página completa: todas las secciones de un departamento sin cache
+    #y luego con las figuras ya en el cache en memoria
+    depto = depto or max(cubo.deptos, key=lambda d: todos[d].total_casos)
+    cache = figcache.FigureCache()
+    #figcache marca la construcción y la serialización de cada figura
+    for seccion in figures.SECCIONES:
+        figcache.figure(cache, fuentes_figuras, seccion, depto)
+    for seccion in figures.SECCIONES:
+        figcache.figure(cache, fuentes_figuras, seccion, depto)
+    etapas.marca('pagina_cache', depto=depto)
+
+    timing.activa(None)
+    if memoria:
+        tracemalloc.stop()
+    return etapas.etapas
+
+
+def _run_size(filas, seed, bench_dir, memoria, depto):
+    csv = synthetic_path(filas, seed, bench_dir)
+    if not os.path.exists(csv):
+        synthetic_csv(csv, filas, seed)
+    siguiente = synthetic_path(filas, seed, bench_dir, siguiente=True)
+    if not os.path.exists(siguiente):
+        next_csv(csv, siguiente, filas, max(int(filas * NUEVOS), 1), seed)
+    etapas = run_stages(csv, memoria=memoria, depto=depto, siguiente=siguiente)
+    return {
+        'filas': filas,
+        'csv_mb': os.path.getsize(csv) / 2 ** 20,
+        'segundos': sum(e['segundos'] for e in etapas),
+        'rss_max_mb': etapas[-1]['rss_max_mb'],
+        'etapas': etapas,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(tamanos=TAMANOS, seed=0, bench_dir=BENCH_DIR, memoria=False, depto=None):
+    resultados = []
+    for filas in tamanos:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            resultados.append(pool.submit(_run_size, filas, seed, bench_dir, memoria, depto).result())
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'semilla': seed,
+        'tracemalloc': memoria,
+        'tamanos': resultados,
+    }
+
+
+def _nombre(etapa):
+    return etapa['etapa'] + (' ' + etapa['seccion'] if 'seccion' in etapa else '')
+
+
+#Tabla de texto con el tiempo de cada etapa y, si hay un reporte anterior,
+#la razón contra él (>1 es más lento)
+def summary(reporte, anterior=None):
+    previos = {}
+    for tamano in (anterior or {}).get('tamanos', []):
+        for e in tamano['etapas']:
+            previos[tamano['filas'], _nombre(e)] = e['segundos']
+
+    lineas = []
+    for tamano in reporte['tamanos']:
+        lineas.append('{:,} filas, RSS máximo {:,.0f} MB'.format(tamano['filas'], tamano['rss_max_mb'] or 0))
+        for e in tamano['etapas'] + [{'etapa': 'total', 'segundos': tamano['segundos']}]:
+            previo = previos.get((tamano['filas'], _nombre(e)))
+            if e['etapa'] == 'total' and anterior:
+                previo = next((t['segundos'] for t in anterior['tamanos'] if t['filas'] == tamano['filas']), None)
+            razon = '  x{:.2f}'.format(e['segundos'] / previo) if previo else ''
+            lineas.append('  {:<40}{:>10.3f} s{}'.format(_nombre(e), e['segundos'], razon))
+    return '\n'.join(lineas)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mide cada etapa del pipeline con CSV sintéticos')
+    parser.add_argument('--rows', type=int, nargs='+', default=TAMANOS, help='tamaños a medir (filas)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bench-dir', default=BENCH_DIR, help='dónde se guardan los CSV sintéticos')
+    parser.add_argument('--tracemalloc', action='store_true', help='mide el pico de memoria de cada etapa (más lento)')
+    parser.add_argument('--depto', default=None, help='departamento de la página medida (por defecto, el de más casos)')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help='reporte anterior para comparar')
+    args = parser.parse_args()
+
+    reporte = run(args.rows, args.seed, args.bench_dir, args.tracemalloc, args.depto)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+
+    anterior = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            anterior = json.load(f)
+    print(summary(reporte, anterior))
@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidcol import cube, data as datos, store
+
+#Índice por (departamento, municipio DIVIPOLA): las filas de la tabla quedan
+#ordenadas por municipio (orden) y cada municipio es un rango contiguo
+#[inicio[i], inicio[i + 1]) de ese orden, así que bajar a cualquier municipio
+#no recorre la tabla. Además se guardan los casos diarios por resultado y los
+#totales de cada municipio para el mapa y la tabla
+CITIES_FILE = 'ciudades.npz'
+
+
+class CityIndex:
+
+    def __init__(self, deptos, codigos, nombres, orden, inicio, conteos, totales, dias, version):
+        self.deptos = np.asarray(deptos)    # departamento de cada municipio
+        self.codigos = np.asarray(codigos)  # código DIVIPOLA de cada municipio
+        self.nombres = list(nombres)
+        self.orden = orden                  # posiciones de las filas ordenadas por municipio
+        self.inicio = np.asarray(inicio)    # (municipios + 1,)
+        self.conteos = conteos              # (municipio, día, resultado)
+        self.totales = np.asarray(totales)  # (municipio, resultado), incluye casos sin fecha
+        self.dias = pd.DatetimeIndex(dias)
+        self.version = version
+        self.lat = np.full(len(self.codigos), np.nan)
+        self.lon = np.full(len(self.codigos), np.nan)
+        self._pos = {(d, c): i for i, (d, c) in enumerate(zip(self.deptos.tolist(), self.codigos.tolist()))}
+
+    #Centroide de cada municipio: el del archivo de municipios si lo tiene,
+    #si no el de su departamento (departamentos_geocode_lat_lon.csv)
+    def resolve_centroids(self, municipios, data_geo):
+        geo = municipios.dropna(subset=['lat']).set_index('CODIGO')
+        self.lat = np.array(pd.Series(self.codigos).map(geo['lat']), dtype=float)
+        self.lon = np.array(pd.Series(self.codigos).map(geo['lon']), dtype=float)
+        geo_depto = data_geo.drop_duplicates('Departamento').set_index('Departamento')
+        sin_centroide = np.isnan(self.lat)
+        deptos = pd.Series(self.deptos[sin_centroide])
+        self.lat[sin_centroide] = deptos.map(geo_depto['lat']).to_numpy(dtype=float)
+        self.lon[sin_centroide] = deptos.map(geo_depto['lon']).to_numpy(dtype=float)
+        return self
+
+    def _indice(self, depto, codigo):
+        return self._pos.get((depto, int(codigo)))
+
+    #Municipios de un departamento con sus totales y centroide
+    def cities(self, depto):
+        i = np.flatnonzero(self.deptos == depto)
+        dg = pd.DataFrame({
+            'Código': self.codigos[i],
+            'Municipio': [self.nombres[j] for j in i],
+            'Casos': self.totales[i].sum(axis=1),
+            'Recuperados': self.totales[i, cube.RESULTADOS.index('Recuperado')],
+            'Fallecidos': self.totales[i, cube.RESULTADOS.index('Fallecido')],
+            'lat': self.lat[i],
+            'lon': self.lon[i],
+        })
+        return dg.sort_values('Casos', ascending=False, kind='mergesort', ignore_index=True)
+
+    #Posiciones de las filas de un municipio en la tabla de la misma versión
+    def rows(self, depto, codigo):
+        i = self._indice(depto, codigo)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.asarray(self.orden[self.inicio[i]:self.inicio[i + 1]])
+
+    #Casos diarios por resultado de un municipio
+    def series(self, depto, codigo):
+        i = self._indice(depto, codigo)
+        conteos = self.conteos[i] if i is not None else np.zeros((len(self.dias), len(cube.RESULTADOS)), dtype=int)
+        dg = pd.DataFrame(np.asarray(conteos), index=self.dias, columns=cube.RESULTADOS)
+        dg['Casos'] = dg.sum(axis=1)
+        dg.index.name = 'Fecha'
+        return dg
+
+    def totals(self, depto, codigo):
+        i = self._indice(depto, codigo)
+        totales = self.totales[i] if i is not None else np.zeros(len(cube.RESULTADOS), dtype=int)
+        return pd.Series(totales, index=cube.RESULTADOS)
+
+
+def build_cities(df, municipios, version=None):
+    deptos, cod_depto = np.unique(df['Departamento_o_Distrito_'].astype(str).to_numpy(), return_inverse=True)
+    codigo = df['Código_DIVIPOLA'].to_numpy().astype(np.int64)
+
+    #Un código por par (departamento, municipio), en orden de departamento y código
+    pares, cod_ciudad = np.unique(cod_depto * (codigo.max(initial=0) + 1) + codigo, return_inverse=True)
+    cod_ciudad = cod_ciudad.ravel()
+    ciudad_depto = pares // (codigo.max(initial=0) + 1)
+    ciudad_codigo = pares % (codigo.max(initial=0) + 1)
+
+    #Filas agrupadas por municipio (orden estable: dentro de cada municipio
+    #quedan en el orden de la tabla)
+    orden = np.argsort(cod_ciudad, kind='stable').astype(np.int64)
+    inicio = np.zeros(len(pares) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cod_ciudad, minlength=len(pares)), out=inicio[1:])
+
+    fechas = df['fecha_reporte_web']
+    dias = pd.date_range(fechas.min(), fechas.max(), freq='D')
+    cod_dia = ((fechas - fechas.min()).dt.days).to_numpy()
+    con_fecha = ~np.isnan(cod_dia)
+    cod_dia = np.where(con_fecha, cod_dia, 0).astype(np.int64)
+    cod_resultado = np.full(df.shape[0], cube.RESULTADOS.index('Activo'), dtype=np.int64)
+    cod_resultado[df['Recuperado'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Recuperado')
+    cod_resultado[df['Falleció'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Fallecido')
+
+    forma = (len(pares), len(dias), len(cube.RESULTADOS))
+    plano = np.ravel_multi_index((cod_ciudad, cod_dia, cod_resultado), forma)
+    conteos = np.bincount(plano[con_fecha], minlength=int(np.prod(forma))).reshape(forma)
+    totales = np.bincount(cod_ciudad * forma[2] + cod_resultado,
+                          minlength=forma[0] * forma[2]).reshape(forma[0], forma[2])
+
+    #Nombre del DIVIPOLA; si el código no está, el de la primera fila del municipio
+    nombres = dict(zip(municipios['CODIGO'], municipios['MUNICIPIO'].astype(str).str.title()))
+    ciudad = df['Ciudad_de_ubicación']
+    ciudad_nombre = [nombres.get(c) or str(ciudad.iloc[orden[inicio[i]]]).title()
+                     for i, c in enumerate(ciudad_codigo.tolist())]
+
+    return CityIndex(deptos[ciudad_depto], ciudad_codigo, ciudad_nombre, orden, inicio,
+                     conteos.astype(np.int32), totales.astype(np.int32), dias, version)
+
+
+#Igual que el cubo: orden y conteos en .npy aparte para abrirlos con mmap
+def save_cities(indice, path):
+    for nombre in ('orden', 'conteos'):
+        store.save_array(getattr(indice, nombre), store.arrays_path(path, 'ciudades-' + nombre, indice.version))
+
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, deptos=np.array(indice.deptos, dtype=str), codigos=indice.codigos,
+             nombres=np.array(indice.nombres, dtype=str), inicio=indice.inicio, totales=indice.totales,
+             dias=indice.dias.to_numpy(), version=np.array(indice.version or '', dtype=str))
+    os.replace(tmp, path)
+
+
+def load_cities(path, mmap_mode='r'):
+    with np.load(path, allow_pickle=False) as z:
+        version = str(z['version'])
+        orden, conteos = [np.load(store.arrays_path(path, 'ciudades-' + nombre, version), mmap_mode=mmap_mode,
+                                  allow_pickle=False) for nombre in ('orden', 'conteos')]
+        return CityIndex(z['deptos'], z['codigos'], z['nombres'].tolist(), orden, z['inicio'], conteos,
+                         z['totales'], z['dias'], version)
+
+
+#Índice de la versión actual de la tabla en cache, se guarda junto a ella.
+#Los centroides se resuelven al cargar (no cambian la versión de los datos)
+def load_or_build(df, cache_dir=store.CACHE_DIR, fuentes=None):
+    fuentes = fuentes or datos.FUENTES
+    municipios = datos.read_municipios(fuentes[1])
+    data_geo = pd.read_csv(fuentes[2])
+    indice = store.load_or_build_derived(cache_dir, CITIES_FILE, load_cities,
+                                         lambda version: build_cities(store.table(df), municipios, version), save_cities)
+    return indice.resolve_centroids(municipios, data_geo)
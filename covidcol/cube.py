@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidcol import store
+
+#Cubo de conteos departamento x día x sexo x rango de edad x resultado.
+#Se construye una vez por versión de datos y todas las gráficas por
+#departamento salen de sumar/cortar este arreglo en vez de filtrar la tabla
+CUBE_FILE = 'cubo.npz'
+
+SEXOS = ['M', 'F', 'No definido']
+RANGOS_EDAD = ['0-5', '5-15', '15-25', '25-45', '45-65', '65-75', '75->', 'Sin dato']
+RESULTADOS = ['Recuperado', 'Fallecido', 'Activo']
+
+
+class Cube:
+
+    def __init__(self, conteos, sin_fecha, deptos, dias, version):
+        self.conteos = conteos      # (depto, día, sexo, edad, resultado)
+        self.sin_fecha = sin_fecha  # (depto, sexo, edad, resultado) casos sin fecha_reporte_web
+        self.deptos = list(deptos)
+        self.dias = pd.DatetimeIndex(dias)
+        self.version = version
+        self._pos_depto = {d: i for i, d in enumerate(self.deptos)}
+
+    #Sub-cubo para un departamento; 'Colombia' (o None) suma todo el país
+    def depto(self, depto=None):
+        if depto is None or depto == 'Colombia':
+            return self.conteos.sum(axis=0)
+        i = self._pos_depto.get(depto)
+        if i is None:
+            return np.zeros(self.conteos.shape[1:], dtype=self.conteos.dtype)
+        return self.conteos[i]
+
+    #Casos diarios para un departamento con filtros opcionales por sexo,
+    #rango de edad o resultado
+    def series(self, depto=None, sexo=None, rango_edad=None, resultado=None):
+        c = self.depto(depto)
+        if sexo is not None:
+            c = c[:, [SEXOS.index(sexo)]]
+        if rango_edad is not None:
+            c = c[:, :, [RANGOS_EDAD.index(rango_edad)]]
+        if resultado is not None:
+            c = c[:, :, :, [RESULTADOS.index(resultado)]]
+        return pd.Series(c.sum(axis=(1, 2, 3)), index=self.dias)
+
+    #Tabla departamento x resultado (incluye casos sin fecha de reporte)
+    def totals_by_depto(self):
+        total = self.conteos.sum(axis=(1, 2, 3)) + self.sin_fecha.sum(axis=(1, 2))
+        return pd.DataFrame(total, index=self.deptos, columns=RESULTADOS)
+
+
+def _codes(serie, categorias):
+    codes = pd.Categorical(serie, categories=categorias).codes.astype(np.int64)
+    codes[codes < 0] = len(categorias) - 1
+    return codes
+
+
+def build_cube(df, version=None):
+    deptos, cod_depto = np.unique(df['Departamento_o_Distrito_'].astype(str).to_numpy(), return_inverse=True)
+
+    fechas = df['fecha_reporte_web']
+    inicio, fin = fechas.min(), fechas.max()
+    dias = pd.date_range(inicio, fin, freq='D')
+    cod_dia = ((fechas - inicio).dt.days).to_numpy()
+    con_fecha = ~np.isnan(cod_dia)
+    cod_dia = np.where(con_fecha, cod_dia, 0).astype(np.int64)
+
+    cod_sexo = _codes(df['Sexo'], SEXOS)
+    cod_edad = _codes(df['Rango_Edad'].astype(object), RANGOS_EDAD)
+    cod_resultado = np.full(df.shape[0], RESULTADOS.index('Activo'), dtype=np.int64)
+    cod_resultado[df['Recuperado'].to_numpy(dtype=bool)] = RESULTADOS.index('Recuperado')
+    cod_resultado[df['Falleció'].to_numpy(dtype=bool)] = RESULTADOS.index('Fallecido')
+
+    forma = (len(deptos), len(dias), len(SEXOS), len(RANGOS_EDAD), len(RESULTADOS))
+    plano = np.ravel_multi_index((cod_depto, cod_dia, cod_sexo, cod_edad, cod_resultado), forma)
+    conteos = np.bincount(plano[con_fecha], minlength=int(np.prod(forma))).reshape(forma)
+
+    forma_sin_fecha = forma[:1] + forma[2:]
+    plano = np.ravel_multi_index((cod_depto, cod_sexo, cod_edad, cod_resultado), forma_sin_fecha)
+    sin_fecha = np.bincount(plano[~con_fecha], minlength=int(np.prod(forma_sin_fecha))).reshape(forma_sin_fecha)
+
+    return Cube(conteos.astype(np.int32), sin_fecha.astype(np.int32), deptos, dias, version)
+
+
+#Los conteos van en un .npy aparte (store.arrays_path) para poder abrirlos
+#con mmap desde varios procesos sin copiarlos
+def save_cube(cube, path):
+    store.save_array(cube.conteos, store.arrays_path(path, 'cubo', cube.version))
+
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, sin_fecha=cube.sin_fecha,
+             deptos=np.array(cube.deptos, dtype=str), dias=cube.dias.to_numpy(),
+             version=np.array(cube.version or '', dtype=str))
+    os.replace(tmp, path)
+
+
+def load_cube(path, mmap_mode='r'):
+    with np.load(path, allow_pickle=False) as z:
+        version = str(z['version'])
+        conteos = np.load(store.arrays_path(path, 'cubo', version), mmap_mode=mmap_mode, allow_pickle=False)
+        return Cube(conteos, z['sin_fecha'], z['deptos'].tolist(), z['dias'], version)
+
+
+#Cubo de la versión actual de la tabla en cache, se guarda junto a ella
+def load_or_build(df, cache_dir=store.CACHE_DIR):
+    return store.load_or_build_derived(cache_dir, CUBE_FILE, load_cube, lambda version: build_cube(store.table(df), version),
+                                       save_cube)
+
+
+#Las series diarias del cubo cubren todo el país; se recortan a los días
+#entre el primer y el último caso del departamento como hacía el groupby
+def trim(serie):
+    con_casos = np.flatnonzero(serie.to_numpy())
+    if len(con_casos) == 0:
+        return serie.iloc[:0]
+    return serie.iloc[con_casos[0]:con_casos[-1] + 1]
+
+
+def velocidad_propagacion(cube, depto=None):
+    dg = trim(cube.series(depto)).resample('W', label='right', closed='right').sum().to_frame('Número de casos')
+    dg.drop(dg.tail(1).index,inplace=True) #drop last row, incomplete 7D seven days
+    dg.drop(dg[dg.index < '2020-03-15'].index, inplace=True)
+    dg['Fila Anterior Número de casos'] = dg['Número de casos'].shift()
+    #Sin casos la semana anterior la razón no está definida (NaN, no infinito)
+    dg['Velocidad de Propagación'] = dg['Número de casos'] / dg['Fila Anterior Número de casos'].where(
+        dg['Fila Anterior Número de casos'] > 0)
+    return dg
+
+
+#Equivalente a pd.crosstab(fecha_reporte_web, columna) con acumulados
+def _acumulado(cube, depto, resultado, nombre):
+    total = cube.series(depto)
+    si = cube.series(depto, resultado=resultado)
+    df = pd.DataFrame({'No': total - si, 'Si': si, 'Total': total})
+    df = df[df['Total'] > 0]
+    df.index.name = 'Fecha'
+    df[nombre + ' Acumulado'] = df['Si'].cumsum()
+    df['Total ' + nombre + ' Acumulado'] = df['Total'].cumsum()
+    df['% Acumulado ' + nombre] = (df[nombre + ' Acumulado'] / df['Total ' + nombre + ' Acumulado'])*100
+    return df
+
+
+def recuperados(cube, depto=None):
+    return _acumulado(cube, depto, 'Recuperado', 'Recuperados')
+
+
+def fallecidos(cube, depto=None):
+    return _acumulado(cube, depto, 'Fallecido', 'Fallecidos')
+
+
+#Tabla de recuperación por departamento (con fila 'Total Casos')
+def recuperados_por_depto(cube, depto=None):
+    totales = cube.totals_by_depto()
+    if depto is not None and depto != 'Colombia':
+        totales = totales.loc[[depto]] if depto in totales.index else totales.iloc[:0]
+    depto_df = pd.DataFrame({'Recuperados': totales['Recuperado'],
+                             'Total Casos': totales.sum(axis=1)})
+    depto_df.loc['Total Casos'] = depto_df.sum()
+    depto_df['% Recuperados'] = (depto_df['Recuperados'] / depto_df['Total Casos']) * 100
+    depto_df.index.name = 'Departamento'
+    return depto_df
@@ -0,0 +1,186 @@
+import pandas as pd
+import numpy as np
+
+from covidcol import dates, schema, timing
+
+#Archivos fuente (off-line)
+CSV_CASOS = 'dataset/Casos_positivos_de_COVID-19_en_Colombia.csv'
+XLS_DIVIPOLA = 'dataset/codigo_divipola.xls'
+CSV_GEO = 'dataset/departamentos_geocode_lat_lon.csv'
+
+FUENTES = [CSV_CASOS, XLS_DIVIPOLA, CSV_GEO]
+
+#Centroides de municipios por código DIVIPOLA (CODIGO, lat, lon). Es opcional:
+#los municipios que no aparecen se ubican en el centroide de su departamento
+CSV_GEO_MUNICIPIOS = 'dataset/municipios_geocode_lat_lon.csv'
+
+#Columnas del CSV del INS que se usan y su tipo al leerlas (evita que pandas
+#adivine el tipo de cada columna y que cambie entre bloques)
+COLUMNAS_CRUDAS = {
+    'ID de caso': 'int64',
+    'Código DIVIPOLA': 'int64',
+    'Ciudad de ubicación': str,
+    'Departamento o Distrito ': str,
+    'atención': str,
+    'Edad': 'float64',
+    'Sexo': str,
+    'Tipo': str,
+    'Estado': str,
+    'País de procedencia': str,
+    'FIS': str,
+    'Fecha de muerte': str,
+    'Fecha diagnostico': str,
+    'Fecha recuperado': str,
+    'fecha reporte web': str,
+    'Tipo recuperación': str,
+}
+
+#Filas por bloque al leer el CSV por partes
+CHUNKSIZE = 200000
+
+
+#Tablas auxiliares: DIVIPOLA (código -> departamento) y lat/lon por departamento
+def read_lookups(xls_divipola=XLS_DIVIPOLA, csv_geo=CSV_GEO):
+    #Leer código Division Pólitica Admin para corregir posibles falata de datos
+    #con el nombre del departamento
+    df_cod_divipola = pd.read_excel(xls_divipola)
+    cod_divipola_dict = dict(zip(df_cod_divipola.CODIGO, df_cod_divipola.DEPARTAMENTO))
+
+    #Información de latitud y longitud para los departamentos del dataset(únicamente)
+    data_geo = pd.read_csv(csv_geo)
+
+    return cod_divipola_dict, data_geo
+
+
+#Municipios del DIVIPOLA con su centroide (NaN si no está en csv_geo_municipios)
+def read_municipios(xls_divipola=XLS_DIVIPOLA, csv_geo_municipios=CSV_GEO_MUNICIPIOS):
+    municipios = pd.read_excel(xls_divipola)
+    try:
+        geo = pd.read_csv(csv_geo_municipios, usecols=['CODIGO', 'lat', 'lon'])
+    except (OSError, ValueError):
+        geo = pd.DataFrame(columns=['CODIGO', 'lat', 'lon'])
+    geo = geo.drop_duplicates('CODIGO').set_index('CODIGO')
+    return municipios.join(geo[['lat', 'lon']].astype(float), on='CODIGO')
+
+
+def read_raw(csv_casos=CSV_CASOS):
+
+    # the file read it's 200MB too big for download
+    '''
+    url = 'https://www.datos.gov.co/api/views/gt2j-8ykr/rows.csv?'
+    url = url + 'accessType=DOWNLOAD&bom=true&format=true&delimiter=%3B'
+
+
+    #Por si algo sale mal al momento de leer los datos
+    try:
+        data = pd.read_csv(url, sep=';')
+    except:
+        data = pd.read_csv(CSV_CASOS, sep=';')
+    '''
+    #read off-line
+    data = _read_csv(csv_casos)
+
+    return _rename(data)
+
+
+#Lectura por bloques de tamaño fijo para no tener todo el CSV en memoria
+def read_raw_chunks(csv_casos=CSV_CASOS, chunksize=CHUNKSIZE):
+    for data in _read_csv(csv_casos, chunksize=chunksize):
+        yield _rename(data)
+
+
+def _read_csv(csv_casos, **kwargs):
+    return pd.read_csv(csv_casos, sep=';', encoding='utf-8-sig', dtype=COLUMNAS_CRUDAS,
+                       usecols=lambda c: c in COLUMNAS_CRUDAS, **kwargs)
+
+
+def _rename(data):
+    #Replace \n (newline) for all columns
+    data.rename(columns=lambda s: s.replace(' ', '_'), inplace=True)
+    data.rename(columns={'ID_de_caso':'casos'}, inplace=True)
+
+    return data
+
+
+#Huella por fila del registro crudo, permite saber qué casos cambiaron
+#entre dos cortes del INS sin volver a limpiar todo
+def row_hash(data):
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+#Limpieza y nuevas variables. Todas las operaciones son por fila, así que se
+#puede aplicar a la tabla completa o solo a los casos nuevos/modificados.
+#En reporte (dict) se acumulan las fechas que no se pudieron convertir.
+#Cada parte de la limpieza se marca en timing (solo mide si está activo)
+def clean_data(data, cod_divipola_dict, data_geo, reporte=None):
+
+    #Corregir departamentos sin datos NaN
+    #buscar el nombre en el diccionario apartir del código
+    data.loc[data['Departamento_o_Distrito_'].isnull(),'Departamento_o_Distrito_'] = data['Código_DIVIPOLA'].map(cod_divipola_dict)
+
+    #Corregir NaN en departamento y Ciudad (Solo si el código anterior no funcionó)
+    data['Departamento_o_Distrito_'] = data['Departamento_o_Distrito_'].fillna('No definido')
+    data['Ciudad_de_ubicación'] = data['Ciudad_de_ubicación'].fillna('No definido')
+
+    #Feature Engineering
+    #Fechas: cada texto distinto se convierte una sola vez para las cinco columnas
+    fechas, invalidas = dates.parse_dates(data)
+    for col in dates.COLUMNAS_FECHA:
+        data[col] = fechas[col]
+    data['fechas_invalidas'] = dates.invalid_bits(invalidas)
+    if reporte is not None:
+        for col, n in dates.count_invalid(data['fechas_invalidas']).items():
+            reporte[col] = reporte.get(col, 0) + n
+    timing.marca('fechas')
+
+    #Estado
+    data['Estado'] = np.where(data['Estado'] == 'leve', 'Leve', data['Estado'])
+    data['Estado'] = data['Estado'].str.strip()
+    data['Departamento_o_Distrito_'] = data['Departamento_o_Distrito_'].str.strip()
+    data['Ciudad_de_ubicación'] = data['Ciudad_de_ubicación'].str.strip()
+    data['País_de_procedencia'] = data['País_de_procedencia'].str.strip()
+    data['Sexo'] = data['Sexo'].str.strip()
+    data['atención'] = data['atención'].str.strip()
+    data['Tipo'] = data['Tipo'].str.strip()
+    data['Sexo'] = data['Sexo'].str.upper()
+
+    #Feature Engenieering
+    #New Features
+    data['Recuperado'] = np.where(data['atención'] == 'Recuperado', 'Si', 'No')
+    data['Falleció'] = np.where(data['atención'] == 'Fallecido', 'Si', 'No')
+    data['Extranjero'] = np.where(data['País_de_procedencia'] == 'Colombia', 'No', 'Si')
+
+    #Edad
+    data['Rango_Edad'] = pd.cut(x=data['Edad'], bins=[0, 5, 15, 25, 45, 65, 75, 999],
+                        labels=['0-5', '5-15', '15-25', '25-45', '45-65', '65-75', '75->'])
+
+    #Días Recuperación
+    data['FIS'] = data['FIS'].fillna(data['fecha_reporte_web'])
+    data['Días de tratamiento'] = abs(data['fecha_reporte_web'] - data['FIS']).dt.days
+    data['Días de tratamiento'] = data['Días de tratamiento'].fillna(0)
+    data['Días de tratamiento'] = data['Días de tratamiento'].astype(int)
+
+    timing.marca('limpieza')
+
+    #Latitud y Longitud (para Departamento)
+    data = data.join(data_geo.set_index('Departamento'), on='Departamento_o_Distrito_')
+    timing.marca('join')
+
+    #Definir Fecha Reporte Web como indice
+    #data = data.rename(columns={'fecha_reporte_web':'index'}).set_index('index')
+
+    #Categorías, booleanos y enteros pequeños (ver schema.py)
+    data = schema.compact(data)
+    timing.marca('tipos')
+
+    #Return data
+    return data
+
+
+def build_data(csv_casos=CSV_CASOS, xls_divipola=XLS_DIVIPOLA, csv_geo=CSV_GEO):
+    cod_divipola_dict, data_geo = read_lookups(xls_divipola, csv_geo)
+    data = read_raw(csv_casos)
+    hash_fila = row_hash(data)
+    data = clean_data(data, cod_divipola_dict, data_geo)
+    data['hash_fila'] = hash_fila
+    return data
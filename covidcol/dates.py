@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+#Columnas de fecha del CSV del INS
+COLUMNAS_FECHA = ['FIS', 'Fecha_de_muerte', 'Fecha_diagnostico', 'Fecha_recuperado', 'fecha_reporte_web']
+
+
+#Convierte las columnas de fecha con una sola tabla de valores distintos:
+#las cinco columnas comparten unos pocos cientos de textos, así que cada uno
+#se convierte una vez y el resultado se reparte con un índice.
+#Devuelve las fechas por columna y, por columna, qué filas tenían un texto no
+#vacío que quedó en NaT
+def parse_dates(data, columnas=COLUMNAS_FECHA, formato='%Y-%m-%d'):
+    valores = pd.concat([data[col] for col in columnas], ignore_index=True)
+    codes, unicos = pd.factorize(valores)
+
+    convertidos = pd.to_datetime(pd.Series(unicos, dtype=object), format=formato, errors='coerce',
+                                 yearfirst=True, exact=False)
+    convertidos = np.append(convertidos.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    fechas = convertidos[codes]
+
+    #Textos que existían pero no son fecha (p.ej. 'Asintomático' en FIS)
+    invalidos = np.isnat(convertidos[:-1])
+    invalidas_por_valor = invalidos[codes] & (codes >= 0)
+
+    n = data.shape[0]
+    resultado, invalidas = {}, {}
+    for i, col in enumerate(columnas):
+        resultado[col] = fechas[i * n:(i + 1) * n]
+        invalidas[col] = invalidas_por_valor[i * n:(i + 1) * n]
+    return resultado, invalidas
+
+
+#Fechas no válidas de cada fila en un byte, un bit por columna de fecha: con
+#la tabla guardada se pueden restar las de los casos que se reemplazan o
+#desaparecen sin volver a leer el CSV
+def invalid_bits(invalidas, columnas=COLUMNAS_FECHA):
+    bits = np.zeros(len(invalidas[columnas[0]]), dtype=np.uint8)
+    for i, col in enumerate(columnas):
+        bits |= invalidas[col].astype(np.uint8) << i
+    return bits
+
+
+def count_invalid(bits, columnas=COLUMNAS_FECHA):
+    bits = np.asarray(bits)
+    return {col: int(((bits >> i) & 1).sum()) for i, col in enumerate(columnas)}
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from covidcol import figures, timing
+
+#Cache de figuras ya serializadas por (sección, departamento, versión de
+#datos). En memoria con desalojo LRU y, opcionalmente, en disco para que
+#sobreviva a un reinicio del proceso
+FIG_DIR = 'dataset/cache_figuras'
+#Se sube cuando cambia cómo se construye alguna figura, para no servir
+#figuras viejas de la misma versión de datos guardadas en disco
+FORMATO = 2
+
+
+class FigureCache:
+
+    def __init__(self, max_entries=512, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._figuras = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version):
+        return '{}-f{}'.format(version, FORMATO)
+
+    def _path(self, seccion, depto, version):
+        nombre = hashlib.sha1(depto.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.disk_dir, self._version_dir(version), seccion + '-' + nombre + '.json')
+
+    def _read_disk(self, clave):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(*clave), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, clave, spec):
+        if not self.disk_dir:
+            return
+        path = self._path(*clave)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp-' + str(threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(spec)
+        os.replace(tmp, path)
+
+    def _remember(self, clave, spec):
+        with self._lock:
+            self._figuras[clave] = spec
+            self._figuras.move_to_end(clave)
+            while len(self._figuras) > self.max_entries:
+                self._figuras.popitem(last=False)
+
+    #JSON de la figura; si no está en cache se construye con build()
+    def get_json(self, seccion, depto, version, build):
+        clave = (seccion, depto, version)
+        with self._lock:
+            spec = self._figuras.get(clave)
+            if spec is not None:
+                self._figuras.move_to_end(clave)
+                self.hits += 1
+                return spec
+
+        spec = self._read_disk(clave)
+        if spec is None:
+            self.misses += 1
+            fig = build()
+            timing.marca('figura_construccion', seccion=seccion)
+            spec = fig.to_json()
+            timing.marca('figura_json', seccion=seccion)
+            self._write_disk(clave, spec)
+        else:
+            self.hits += 1
+        self._remember(clave, spec)
+        return spec
+
+    #Figura como diccionario, listo para st.plotly_chart
+    def get(self, seccion, depto, version, build):
+        return json.loads(self.get_json(seccion, depto, version, build))
+
+    #Borra del disco las figuras de versiones anteriores
+    def prune_disk(self, version):
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        for nombre in os.listdir(self.disk_dir):
+            if nombre != self._version_dir(version):
+                shutil.rmtree(os.path.join(self.disk_dir, nombre), ignore_errors=True)
+
+
+#'fuentes' puede ser una función que las carga: así una figura que ya está
+#en cache no obliga a abrir los datos. En ese caso hay que dar 'version'
+def figure(cache, fuentes, seccion, depto, version=None):
+    if version is None:
+        version = fuentes.cubo.version
+    return cache.get(seccion, depto, version,
+                     lambda: figures.SECCIONES[seccion](_resolve(fuentes), depto))
+
+
+def _resolve(fuentes):
+    return fuentes() if callable(fuentes) else fuentes
+
+
+#Construye todas las secciones para 'Colombia' y cada departamento, así el
+#primer visitante de cualquier departamento ya encuentra su figura. Con
+#'fuentes' como función y 'deptos' y 'version' dados, las figuras que ya
+#están en disco no abren los datos
+def prewarm(cache, fuentes, deptos=None, version=None):
+    if deptos is None or version is None:
+        fuentes = _resolve(fuentes)
+        version = fuentes.cubo.version
+        deptos = fuentes.cubo.deptos if deptos is None else deptos
+    deptos = ['Colombia'] + sorted(deptos)
+    for depto in deptos:
+        for seccion in figures.SECCIONES:
+            figure(cache, fuentes, seccion, depto, version)
+    cache.prune_disk(version)
+    return len(deptos) * len(figures.SECCIONES)
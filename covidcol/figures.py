@@ -0,0 +1,264 @@
+import plotly.express as px
+import plotly.graph_objects as go
+
+from covidcol import aggregate, cube, growth, sir, survival
+
+#Datos ya agregados de los que salen todas las gráficas de la página. Los que
+#no se dan se piden a cargar(nombre) la primera vez que una sección los usa,
+#así construir una sección no carga lo que solo usan las demás
+CAMPOS = ('cubo', 'edades', 'edad_tratamiento', 'casos_por_depto', 'crecimiento', 'supervivencia')
+
+
+class Fuentes:
+
+    def __init__(self, cargar=None, **fuentes):
+        self._cargar = cargar
+        self.__dict__.update(fuentes)
+
+    def __getattr__(self, nombre):
+        #Solo se llama si el atributo todavía no está cargado
+        if nombre.startswith('_') or nombre not in CAMPOS or self._cargar is None:
+            raise AttributeError(nombre)
+        valor = self._cargar(nombre)
+        setattr(self, nombre, valor)
+        return valor
+
+
+#Series que se pueden elegir en la gráfica de propagación: la velocidad
+#semanal y las métricas de growth.py. Las que se comparan contra 1 llevan la línea
+def _series_propagacion(fuentes, depto):
+    dg = cube.velocidad_propagacion(fuentes.cubo, depto)
+    series = [('Velocidad de Propagación', dg['Velocidad de Propagación'], True)]
+    metricas = fuentes.crecimiento.frame(depto)
+    for metrica, nombre in growth.METRICAS.items():
+        series.append((nombre, metricas[metrica], metrica in ('factor_crecimiento', 'rt')))
+    return series
+
+
+def velocidad(fuentes, depto):
+    series = _series_propagacion(fuentes, depto)
+    pais = _series_propagacion(fuentes, 'Colombia') if depto != 'Colombia' else None
+
+    #Initialize Figure
+    f = go.Figure()
+
+    grupos, lineas = [], []
+    for i, (nombre, serie, referencia) in enumerate(series):
+        trazas = []
+        if pais is not None:
+            f.add_trace(go.Scatter(x=pais[i][1].index,
+                                    y=pais[i][1],
+                                    mode='lines',
+                                    name='Colombia',
+                                    visible=(i == 0)))
+            trazas.append(len(f.data) - 1)
+
+        f.add_trace(go.Scatter(
+            x=serie.index,
+            y=serie,
+            mode='lines+markers',
+            name=depto,
+            visible=(i == 0)
+        ))
+        trazas.append(len(f.data) - 1)
+        grupos.append(trazas)
+
+        lineas.append([dict(
+            # Line Horizontal
+                type="line",
+                x0=serie.index.min(),
+                y0=1,
+                x1=serie.index.max(),
+                y1=1,
+                line=dict(
+                    color="green",
+                    width=2,
+                    dash="solid",
+                ),
+        )] if referencia and len(serie) else [])
+
+    #Menú para elegir la serie
+    botones = []
+    for i, (nombre, _, _) in enumerate(series):
+        visibles = [t in grupos[i] for t in range(len(f.data))]
+        botones.append(dict(label=nombre, method='update',
+                            args=[{'visible': visibles}, {'yaxis.title.text': nombre, 'shapes': lineas[i]}]))
+    f.update_layout(shapes=lineas[0],
+                    updatemenus=[dict(buttons=botones, direction='down', x=0, xanchor='left', y=1.2, yanchor='top')])
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title=series[0][0])
+    return f
+
+
+def recuperados(fuentes, depto):
+    recu_df = cube.recuperados(fuentes.cubo, depto)
+
+    #Initialize Figure
+    f = go.Figure()
+
+    if depto != 'Colombia':
+        pais = cube.recuperados(fuentes.cubo)
+        f.add_trace(go.Scatter(x=pais.index, y=pais['% Acumulado Recuperados'],
+                        mode='lines',
+                        name='Total Casos Colombia'))
+
+    f.add_trace(go.Scatter(x=recu_df.index, y=recu_df['% Acumulado Recuperados'],
+                        mode='lines+markers',
+                        name='Total Casos ' + depto))
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="% Acumulado Personas Recuperadas")
+    return f
+
+
+def fallecidos(fuentes, depto):
+    fallecio_df = cube.fallecidos(fuentes.cubo, depto)
+
+    #Initialize Figure
+    f = go.Figure()
+
+    if depto != 'Colombia':
+        pais = cube.fallecidos(fuentes.cubo)
+        f.add_trace(go.Scatter(x=pais.index, y=pais['% Acumulado Fallecidos'],
+                        mode='lines',
+                        name='Total Casos Colombia'))
+
+    f.add_trace(go.Scatter(x=fallecio_df.index, y=fallecio_df['% Acumulado Fallecidos'],
+                        mode='lines+markers',
+                        name='Total Casos ' + depto))
+
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="% Acumulado Personas Fallecidas")
+    return f
+
+
+def edad(fuentes, depto):
+    dg = aggregate.edades_depto(fuentes.edades, depto)
+    f = px.histogram(dg, x="Edad", y="Casos", histfunc='sum', nbins=15, title=None)
+    f.update_xaxes(title="Edad")
+    f.update_yaxes(title="Casos positivos")
+    return f
+
+
+def sexo(fuentes, depto):
+    #Initialize Figure
+    f = go.Figure()
+
+    # Add traces
+    for sexo, nombre, modo in [(None, 'Total Casos', 'lines+markers'),
+                               ('F', 'Femenino', 'lines'),
+                               ('M', 'Masculino', 'lines')]:
+        dg = fuentes.cubo.series(depto, sexo=sexo)
+        dg = dg[dg > 0]
+        f.add_trace(go.Scatter(x=dg.index, y=dg,
+                            mode=modo,
+                            name=nombre))
+
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="#. de casos")
+    return f
+
+
+def edad_tratamiento(fuentes, depto):
+    #Un punto por combinación edad/días/resultado, el tamaño es el número de casos
+    dg = aggregate.edad_tratamiento_depto(fuentes.edad_tratamiento, depto)
+    return px.scatter(dg, x="Edad", y="Días de tratamiento", size="Casos", color='Falleció',
+                      hover_data=['Casos'])
+
+
+def mapa(fuentes, depto):
+    #Un punto por departamento, el tamaño es el número de casos
+    dg = fuentes.casos_por_depto
+    if depto != 'Colombia':
+        dg = dg[dg['Departamento'] == depto]
+    return px.scatter_mapbox(dg, lat='lat', lon='lon', size='Casos', hover_name='Departamento',
+                             hover_data=['Casos'], zoom=4, mapbox_style='carto-positron')
+
+
+def modelo_sir(fuentes, depto):
+    obs, ajuste = sir.fit_depto(fuentes.cubo, depto)
+    modelo = sir.fitted_curves(obs, ajuste)
+
+    #Initialize Figure
+    f = go.Figure()
+    f.add_trace(go.Scatter(x=obs.index, y=obs['Infectados'], mode='markers', name='Infectados (INS)'))
+    f.add_trace(go.Scatter(x=obs.index, y=obs['Removidos'], mode='markers', name='Recuperados y fallecidos (INS)'))
+    f.add_trace(go.Scatter(x=modelo.index, y=modelo['Infectados'], mode='lines', name='Infectados (SIR)'))
+    f.add_trace(go.Scatter(x=modelo.index, y=modelo['Removidos'], mode='lines', name='Recuperados y fallecidos (SIR)'))
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="#. de personas")
+    return f
+
+
+#Kaplan-Meier por rango de edad: fracción que aún no se recupera (o no ha
+#fallecido) según los días desde el inicio de síntomas; el menú cambia el desenlace
+def supervivencia(fuentes, depto):
+    #Initialize Figure
+    f = go.Figure()
+
+    grupos = []
+    for i, desenlace in enumerate(survival.DESENLACES):
+        curvas = fuentes.supervivencia.curves(depto, desenlace)
+        trazas = []
+        for rango in curvas.columns:
+            f.add_trace(go.Scatter(x=curvas.index, y=curvas[rango], mode='lines', name=rango,
+                                   line_shape='hv', visible=(i == 0)))
+            trazas.append(len(f.data) - 1)
+        grupos.append(trazas)
+
+    #Menú para elegir el desenlace
+    botones = []
+    for i, desenlace in enumerate(survival.DESENLACES):
+        visibles = [t in grupos[i] for t in range(len(f.data))]
+        botones.append(dict(label=desenlace, method='update',
+                            args=[{'visible': visibles}, {'yaxis.title.text': 'Fracción sin ' + desenlace.lower()}]))
+    f.update_layout(updatemenus=[dict(buttons=botones, direction='down', x=0, xanchor='left', y=1.2, yanchor='top')])
+    f.update_xaxes(title="Días desde el inicio de síntomas")
+    f.update_yaxes(title='Fracción sin ' + survival.DESENLACES[0].lower())
+    return f
+
+
+#Municipios de un departamento (cities.CityIndex.cities), el tamaño es el número de casos
+def municipios(dg):
+    return px.scatter_mapbox(dg, lat='lat', lon='lon', size='Casos', hover_name='Municipio',
+                             hover_data=['Casos', 'Recuperados', 'Fallecidos'], zoom=6,
+                             mapbox_style='carto-positron')
+
+
+#Casos diarios de un municipio (cities.CityIndex.series)
+def municipio(dg, nombre):
+    #Initialize Figure
+    f = go.Figure()
+    f.add_trace(go.Bar(x=dg.index, y=dg['Casos'], name='Casos ' + nombre))
+    f.add_trace(go.Scatter(x=dg.index, y=dg['Recuperado'].cumsum(), mode='lines', name='Recuperados acumulados'))
+    f.add_trace(go.Scatter(x=dg.index, y=dg['Fallecido'].cumsum(), mode='lines', name='Fallecidos acumulados'))
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="#. de casos")
+    return f
+
+
+#Casos diarios y acumulados de una ventana con filtros (prefix.PrefixCube.window);
+#no va en SECCIONES porque depende de los filtros y no solo del departamento
+def filtrado(dg):
+    #Initialize Figure
+    f = go.Figure()
+    f.add_trace(go.Bar(x=dg.index, y=dg['Casos'], name='Casos diarios'))
+    for col, nombre in [('Casos Acumulado', 'Casos acumulados'),
+                        ('Recuperado Acumulado', 'Recuperados acumulados'),
+                        ('Fallecido Acumulado', 'Fallecidos acumulados')]:
+        f.add_trace(go.Scatter(x=dg.index, y=dg[col], mode='lines', name=nombre))
+    f.update_xaxes(title="Fecha")
+    f.update_yaxes(title="#. de casos")
+    return f
+
+
+SECCIONES = {
+    'velocidad': velocidad,
+    'recuperados': recuperados,
+    'fallecidos': fallecidos,
+    'edad': edad,
+    'sexo': sexo,
+    'edad_tratamiento': edad_tratamiento,
+    'mapa': mapa,
+    'sir': modelo_sir,
+    'supervivencia': supervivencia,
+}
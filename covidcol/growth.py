@@ -0,0 +1,136 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidcol import store
+
+#Métricas de crecimiento para todos los departamentos a la vez, sobre la
+#matriz departamento x día de casos nuevos (la última fila es Colombia).
+#Cada métrica es una operación de NumPy sobre toda la matriz: ventanas
+#móviles con sumas acumuladas y Rt con una convolución por el intervalo serial
+GROWTH_FILE = 'crecimiento.npz'
+
+VENTANA = 7
+#Intervalo serial de COVID-19 (Nishiura et al. 2020): gamma con media 4.7 y
+#desviación 2.9 días, discretizado hasta 20 días
+SERIAL_MEDIA = 4.7
+SERIAL_DESVIACION = 2.9
+SERIAL_DIAS = 20
+#Prior gamma del método de Cori (media 5, desviación 5) y casos mínimos en la
+#ventana para reportar Rt
+PRIOR_A = 1.0
+PRIOR_B = 5.0
+MIN_CASOS = 12
+
+METRICAS = {
+    'promedio_7d': 'Promedio 7 días',
+    'factor_crecimiento': 'Factor de crecimiento (7 días)',
+    'tiempo_duplicacion': 'Tiempo de duplicación (días)',
+    'rt': 'Rt (Cori)',
+}
+
+
+def serial_interval(media=SERIAL_MEDIA, desviacion=SERIAL_DESVIACION, dias=SERIAL_DIAS):
+    forma = (media / desviacion) ** 2
+    escala = desviacion ** 2 / media
+    k = np.arange(1, dias + 1, dtype=float)
+    w = np.exp((forma - 1) * np.log(k) - k / escala - forma * math.log(escala) - math.lgamma(forma))
+    return np.concatenate([[0.0], w / w.sum()])
+
+
+#Suma de los últimos 'ventana' días por fila (NaN mientras no hay ventana completa)
+def _rolling_sum(m, ventana):
+    acumulado = np.zeros((m.shape[0], m.shape[1] + 1))
+    np.cumsum(m, axis=1, out=acumulado[:, 1:])
+    suma = np.full(m.shape, np.nan)
+    suma[:, ventana - 1:] = acumulado[:, ventana:] - acumulado[:, :-ventana]
+    return suma
+
+
+def _shift(m, dias):
+    desplazado = np.full(m.shape, np.nan)
+    desplazado[:, dias:] = m[:, :-dias]
+    return desplazado
+
+
+#Todas las métricas para una matriz de casos nuevos (filas x días)
+def compute(casos, ventana=VENTANA, w=None):
+    casos = np.asarray(casos, dtype=float)
+    w = serial_interval() if w is None else w
+
+    promedio = _rolling_sum(casos, ventana) / ventana
+    anterior = _shift(promedio, ventana)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(anterior > 0, promedio / anterior, np.nan)
+        #Tasa diaria de crecimiento y tiempo de duplicación (solo si crece)
+        tasa = np.log(factor) / ventana
+        duplicacion = np.where(tasa > 0, math.log(2) / tasa, np.nan)
+
+    #Infectividad: casos de los días anteriores pesados por el intervalo serial
+    infectividad = np.zeros_like(casos)
+    for k in range(1, min(len(w), casos.shape[1])):
+        infectividad[:, k:] += w[k] * casos[:, :-k]
+
+    #Rt de Cori: media posterior con prior gamma en ventanas de 'ventana' días
+    casos_ventana = _rolling_sum(casos, ventana)
+    infectividad_ventana = _rolling_sum(infectividad, ventana)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rt = (PRIOR_A + casos_ventana) / (1 / PRIOR_B + infectividad_ventana)
+    rt = np.where(casos_ventana >= MIN_CASOS, rt, np.nan)
+
+    return {'promedio_7d': promedio, 'factor_crecimiento': factor,
+            'tiempo_duplicacion': duplicacion, 'rt': rt}
+
+
+class Growth:
+
+    def __init__(self, metricas, deptos, dias, version):
+        self.metricas = metricas  # nombre -> (depto + Colombia, día)
+        self.deptos = list(deptos)
+        self.dias = pd.DatetimeIndex(dias)
+        self.version = version
+        self._pos = {d: i for i, d in enumerate(self.deptos)}
+        self._pos['Colombia'] = len(self.deptos)
+
+    #Métricas de un departamento ('Colombia' para el país), desde su primer caso
+    def frame(self, depto='Colombia'):
+        i = self._pos.get(depto)
+        if i is None:
+            return pd.DataFrame(columns=list(METRICAS), index=self.dias[:0], dtype=float)
+        dg = pd.DataFrame({m: self.metricas[m][i] for m in METRICAS}, index=self.dias)
+        dg.index.name = 'Fecha'
+        con_casos = np.flatnonzero(dg['promedio_7d'].fillna(0).to_numpy() > 0)
+        return dg.iloc[con_casos[0]:] if len(con_casos) else dg.iloc[:0]
+
+    #Último valor conocido de una métrica
+    def latest(self, depto, metrica):
+        serie = self.frame(depto)[metrica].dropna()
+        return serie.iloc[-1] if len(serie) else np.nan
+
+
+#Métricas de todos los departamentos a partir del cubo de conteos
+def build_growth(cubo):
+    casos = np.asarray(cubo.conteos).sum(axis=(2, 3, 4))
+    casos = np.vstack([casos, casos.sum(axis=0)])
+    return Growth(compute(casos), cubo.deptos, cubo.dias, cubo.version)
+
+
+def save_growth(crecimiento, path):
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, deptos=np.array(crecimiento.deptos, dtype=str), dias=crecimiento.dias.to_numpy(),
+             version=np.array(crecimiento.version or '', dtype=str),
+             **{m: v.astype(np.float32) for m, v in crecimiento.metricas.items()})
+    os.replace(tmp, path)
+
+
+def load_growth(path):
+    with np.load(path, allow_pickle=False) as z:
+        return Growth({m: z[m] for m in METRICAS}, z['deptos'].tolist(), z['dias'], str(z['version']))
+
+
+#Métricas de la versión del cubo, se guardan junto a él
+def load_or_build(cubo, cache_dir=store.CACHE_DIR):
+    return store.load_or_build_derived(cache_dir, GROWTH_FILE, load_growth, lambda version: build_growth(cubo),
+                                       save_growth, cubo.version)
@@ -0,0 +1,134 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+#Cifras del encabezado y de las secciones de la página para un departamento
+KPIs = namedtuple('KPIs', [
+    'total_casos', 'recuperados', 'fallecidos', 'tasa_recuperados', 'tasa_fallecidos',
+    'fecha_reporte_inicial', 'fecha_reporte',
+    'edad_promedio', 'edad_mas_casos', 'edad_maxima',
+    'total_casos_hombres', 'total_casos_mujeres', 'tasa_casos_hombres', 'tasa_casos_mujeres',
+    'recuperados_hombres', 'recuperados_mujeres', 'tasa_recuperacion_hombres', 'tasa_recuperacion_mujeres',
+    'edad_prom_mas_muerte', 'edad_mas_muerte',
+    'min_dia_tratamiento_recu', 'max_dia_tratamiento_recu',
+    'prom_dia_tratamiento_recu', 'mode_dia_tratamiento_recu',
+])
+
+
+#Histograma (departamento x valor entero) con un solo np.bincount; la última
+#fila es el total del país
+def _histogram(grupo, valores, n_grupos, mascara=None):
+    validos = valores >= 0
+    if mascara is not None:
+        validos &= mascara
+    valores = valores[validos].astype(np.int64)
+    ancho = int(valores.max()) + 1 if len(valores) else 1
+    plano = grupo[validos] * ancho + valores
+    hist = np.bincount(plano, minlength=n_grupos * ancho).reshape(n_grupos, ancho)
+    return np.vstack([hist, hist.sum(axis=0)])
+
+
+#Mediana como en pandas (promedio de los dos valores centrales) a partir
+#del histograma acumulado, sin ordenar las filas
+def _median(hist):
+    n = hist.sum(axis=1)
+    acumulado = hist.cumsum(axis=1)
+    bajo = (acumulado <= ((n - 1) // 2)[:, None]).sum(axis=1)
+    alto = (acumulado <= (n // 2)[:, None]).sum(axis=1)
+    return np.where(n > 0, (bajo + alto) / 2.0, np.nan)
+
+
+#Moda como df[col].mode()[0] (el menor valor en caso de empate)
+def _mode(hist):
+    return np.where(hist.sum(axis=1) > 0, hist.argmax(axis=1).astype(float), np.nan)
+
+
+def _max(hist):
+    con_datos = hist > 0
+    ultimo = hist.shape[1] - 1 - con_datos[:, ::-1].argmax(axis=1)
+    return np.where(con_datos.any(axis=1), ultimo.astype(float), np.nan)
+
+
+def _min(hist):
+    con_datos = hist > 0
+    return np.where(con_datos.any(axis=1), con_datos.argmax(axis=1).astype(float), np.nan)
+
+
+def _ratio(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / b
+
+
+#Calcula los KPIs de todos los departamentos y de 'Colombia' en un solo
+#recorrido; devuelve un diccionario departamento -> KPIs
+def compute_kpis(df):
+    grupo, deptos = pd.factorize(df['Departamento_o_Distrito_'], sort=True)
+    n = len(deptos)
+    deptos = list(deptos) + ['Colombia']
+
+    recuperado = df['Recuperado'].to_numpy(dtype=bool)
+    fallecio = df['Falleció'].to_numpy(dtype=bool)
+    hombre = (df['Sexo'] == 'M').to_numpy()
+    mujer = (df['Sexo'] == 'F').to_numpy()
+    edad = df['Edad'].to_numpy(dtype=float)
+    dias = df['Días de tratamiento'].to_numpy(dtype=float)
+
+    def contar(mascara=None):
+        conteo = np.bincount(grupo if mascara is None else grupo[mascara], minlength=n)
+        return np.append(conteo, conteo.sum())
+
+    total_casos = contar()
+    recuperados = contar(recuperado)
+    fallecidos = contar(fallecio)
+    hombres = contar(hombre)
+    mujeres = contar(mujer)
+    recuperados_hombres = contar(recuperado & hombre)
+    recuperados_mujeres = contar(recuperado & mujer)
+
+    hist_edad = _histogram(grupo, edad, n)
+    hist_edad_muerte = _histogram(grupo, edad, n, fallecio)
+    hist_tratamiento = _histogram(grupo, dias, n, recuperado & (dias > 0))
+
+    edad_promedio = _median(hist_edad)
+    edad_maxima = _max(hist_edad)
+    edad_mas_casos = np.where(np.isnan(_mode(hist_edad)), edad_promedio, _mode(hist_edad))
+    edad_prom_mas_muerte = _median(hist_edad_muerte)
+    edad_mas_muerte = np.where(np.isnan(_mode(hist_edad_muerte)), edad_prom_mas_muerte, _mode(hist_edad_muerte))
+    prom_dia_tratamiento = _median(hist_tratamiento)
+    mode_dia_tratamiento = np.where(np.isnan(_mode(hist_tratamiento)), prom_dia_tratamiento, _mode(hist_tratamiento))
+    min_dia_tratamiento = _min(hist_tratamiento)
+    max_dia_tratamiento = _max(hist_tratamiento)
+
+    rango_fechas = df['fecha_reporte_web'].groupby(grupo).agg(['min', 'max']).reindex(range(n))
+    rango_fechas.loc[n] = [df['fecha_reporte_web'].min(), df['fecha_reporte_web'].max()]
+
+    resultado = {}
+    for i, depto in enumerate(deptos):
+        resultado[depto] = KPIs(
+            total_casos=int(total_casos[i]),
+            recuperados=int(recuperados[i]),
+            fallecidos=int(fallecidos[i]),
+            tasa_recuperados=_ratio(recuperados[i], total_casos[i]),
+            tasa_fallecidos=_ratio(fallecidos[i], total_casos[i]),
+            fecha_reporte_inicial=rango_fechas['min'].iloc[i],
+            fecha_reporte=rango_fechas['max'].iloc[i],
+            edad_promedio=edad_promedio[i],
+            edad_mas_casos=edad_mas_casos[i],
+            edad_maxima=edad_maxima[i],
+            total_casos_hombres=int(hombres[i]),
+            total_casos_mujeres=int(mujeres[i]),
+            tasa_casos_hombres=_ratio(hombres[i], total_casos[i]),
+            tasa_casos_mujeres=_ratio(mujeres[i], total_casos[i]),
+            recuperados_hombres=int(recuperados_hombres[i]),
+            recuperados_mujeres=int(recuperados_mujeres[i]),
+            tasa_recuperacion_hombres=_ratio(recuperados_hombres[i], recuperados[i]),
+            tasa_recuperacion_mujeres=_ratio(recuperados_mujeres[i], recuperados[i]),
+            edad_prom_mas_muerte=edad_prom_mas_muerte[i],
+            edad_mas_muerte=edad_mas_muerte[i],
+            min_dia_tratamiento_recu=min_dia_tratamiento[i],
+            max_dia_tratamiento_recu=max_dia_tratamiento[i],
+            prom_dia_tratamiento_recu=prom_dia_tratamiento[i],
+            mode_dia_tratamiento_recu=mode_dia_tratamiento[i],
+        )
+    return resultado
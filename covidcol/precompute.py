@@ -0,0 +1,123 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from covidcol import aggregate, cities, cube, figcache, figures, growth, kpis, prefix, sir, store, survival
+
+#Precálculo de todos los departamentos en paralelo. Los procesos no reciben
+#la tabla: abren el cubo del cache con mmap y solo reciben los agregados
+#pequeños (edades, edad/días, casos por departamento, métricas de
+#crecimiento, histogramas de supervivencia). Los resultados quedan en el cache para que la página solo los lea
+RESULTADOS_FILE = 'resultados.json'
+
+_fuentes = None
+_figuras = None
+
+
+def _init_worker(cache_dir, fig_dir, edades, edad_tratamiento, casos_por_depto, crecimiento, supervivencia):
+    global _fuentes, _figuras
+    cubo = cube.load_cube(os.path.join(cache_dir, cube.CUBE_FILE))
+    _fuentes = figures.Fuentes(cubo=cubo, edades=edades, edad_tratamiento=edad_tratamiento,
+                               casos_por_depto=casos_por_depto, crecimiento=crecimiento, supervivencia=supervivencia)
+    _figuras = figcache.FigureCache(disk_dir=fig_dir)
+
+
+#Todo lo que depende de un solo departamento: serie semanal de propagación,
+#ajuste SIR y las figuras de cada sección
+def _precompute_depto(depto):
+    dg = cube.velocidad_propagacion(_fuentes.cubo, depto)
+    vp = dg['Velocidad de Propagación'].iloc[-1] if len(dg) else np.nan
+    _, ajuste = sir.fit_depto(_fuentes.cubo, depto)
+    for seccion in figures.SECCIONES:
+        figcache.figure(_figuras, _fuentes, seccion, depto)
+    return depto, float(vp), [float(x) for x in ajuste]
+
+
+def _to_json(valor):
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    if isinstance(valor, (np.integer, np.floating)):
+        valor = valor.item()
+    if isinstance(valor, float) and np.isnan(valor):
+        return None
+    return valor
+
+
+def run(cache_dir=store.CACHE_DIR, fig_dir=figcache.FIG_DIR, workers=None):
+    return precompute_all(store.load_or_build(cache_dir), cache_dir, fig_dir, workers)
+
+
+#Precalcula a partir de una tabla ya cargada de cache_dir. anterior_dir es el
+#directorio de la versión anterior (si no es cache_dir) para actualizar los
+#histogramas de supervivencia solo con los casos que cambiaron
+def precompute_all(df, cache_dir=store.CACHE_DIR, fig_dir=figcache.FIG_DIR, workers=None, anterior_dir=None):
+    cubo = cube.load_or_build(df, cache_dir)
+    prefix.load_or_build(df, cache_dir)
+    cities.load_or_build(df, cache_dir)
+    todos = kpis.compute_kpis(df)
+    #Los agregados quedan junto a resultados.json: la página los lee de ahí
+    agregados = aggregate.load_or_build(df, cache_dir)
+    args = (cache_dir, fig_dir, agregados.edades, agregados.edad_tratamiento, agregados.casos_por_depto,
+            growth.load_or_build(cubo, cache_dir), survival.load_or_build(df, cache_dir, anterior_dir))
+    del df
+
+    deptos = ['Colombia'] + sorted(cubo.deptos)
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=args) as pool:
+        for depto, vp, ajuste in pool.map(_precompute_depto, deptos):
+            resultados[depto] = {
+                'kpis': {k: _to_json(v) for k, v in todos[depto]._asdict().items()},
+                'velocidad_propagacion': _to_json(vp),
+                'sir': dict(zip(sir.Ajuste._fields, (_to_json(x) for x in ajuste))),
+            }
+
+    path = os.path.join(cache_dir, RESULTADOS_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': cubo.version, 'deptos': resultados}, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    figcache.FigureCache(disk_dir=fig_dir).prune_disk(cubo.version)
+    return cubo.version, len(deptos)
+
+
+def _from_json(valor):
+    return np.nan if valor is None else valor
+
+
+#Resultados precalculados de la versión actual, o None si no existen
+def load_results(cache_dir=store.CACHE_DIR):
+    manifest = store.read_manifest(cache_dir)
+    try:
+        with open(os.path.join(cache_dir, RESULTADOS_FILE), encoding='utf-8') as f:
+            guardado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest is None or guardado['version'] != manifest['version']:
+        return None
+
+    resultados = {}
+    for depto, r in guardado['deptos'].items():
+        valores = {k: _from_json(v) for k, v in r['kpis'].items()}
+        for k in ('fecha_reporte_inicial', 'fecha_reporte'):
+            valores[k] = pd.Timestamp(valores[k]) if isinstance(valores[k], str) else pd.NaT
+        resultados[depto] = {
+            'kpis': kpis.KPIs(**valores),
+            'velocidad_propagacion': _from_json(r['velocidad_propagacion']),
+            'sir': sir.Ajuste(**{k: _from_json(v) for k, v in r['sir'].items()}),
+        }
+    return resultados
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Precalcula cifras, ajustes SIR y figuras de todos los departamentos')
+    parser.add_argument('--workers', type=int, default=None, help='número de procesos (por defecto, uno por CPU)')
+    parser.add_argument('--cache-dir', default=store.CACHE_DIR)
+    parser.add_argument('--fig-dir', default=figcache.FIG_DIR)
+    args = parser.parse_args()
+
+    version, n = run(args.cache_dir, args.fig_dir, args.workers)
+    print('Versión {}: {} departamentos precalculados'.format(version, n))
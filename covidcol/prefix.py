@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidcol import cube, store
+
+#Conteos departamento x día x sexo x rango de edad x tipo x extranjero x
+#resultado guardados como sumas acumuladas sobre el eje de los días: el total
+#de cualquier ventana de fechas es acumulado[fin + 1] - acumulado[inicio], así
+#que un filtro nuevo no vuelve a recorrer la tabla, solo suma las celdas de
+#las categorías elegidas
+PREFIX_FILE = 'prefijos.npz'
+
+EXTRANJERO = ['No', 'Si']
+
+
+class PrefixCube:
+
+    def __init__(self, acumulados, deptos, dias, tipos, version):
+        self.acumulados = acumulados  # (depto, día + 1, sexo, edad, tipo, extranjero, resultado)
+        self.deptos = list(deptos)
+        self.dias = pd.DatetimeIndex(dias)
+        self.tipos = list(tipos)
+        self.version = version
+
+    #Posición del primer día >= inicio y del último día <= fin
+    def _dias(self, inicio, fin):
+        i0 = 0 if inicio is None else int(self.dias.searchsorted(pd.Timestamp(inicio), side='left'))
+        i1 = len(self.dias) - 1 if fin is None else int(self.dias.searchsorted(pd.Timestamp(fin), side='right')) - 1
+        return i0, max(i1, i0 - 1)
+
+    #Acumulados de la ventana [inicio, fin] para las categorías elegidas
+    #(None = todas), con forma (días de la ventana + 1, resultado)
+    def _window(self, inicio, fin, deptos, sexos, rangos_edad, tipos, extranjero):
+        i0, i1 = self._dias(inicio, fin)
+        a = self.acumulados[:, i0:i1 + 2]
+        for eje, elegidos, categorias in [(0, deptos, self.deptos), (2, sexos, cube.SEXOS),
+                                          (3, rangos_edad, cube.RANGOS_EDAD), (4, tipos, self.tipos),
+                                          (5, extranjero, EXTRANJERO)]:
+            if elegidos is not None:
+                a = np.take(a, [categorias.index(c) for c in elegidos if c in categorias], axis=eje)
+        return a.sum(axis=(0, 2, 3, 4, 5), dtype=np.int64), self.dias[i0:i1 + 1]
+
+    #Casos diarios y acumulados desde el inicio de la ventana, por resultado
+    def window(self, inicio=None, fin=None, deptos=None, sexos=None, rangos_edad=None, tipos=None,
+               extranjero=None):
+        a, dias = self._window(inicio, fin, deptos, sexos, rangos_edad, tipos, extranjero)
+        diarios = np.diff(a, axis=0)
+        acumulados = a[1:] - a[0]
+        dg = pd.DataFrame(diarios, index=dias, columns=cube.RESULTADOS)
+        dg['Casos'] = diarios.sum(axis=1)
+        for i, resultado in enumerate(cube.RESULTADOS):
+            dg[resultado + ' Acumulado'] = acumulados[:, i]
+        dg['Casos Acumulado'] = acumulados.sum(axis=1)
+        dg.index.name = 'Fecha'
+        return dg
+
+    #Totales de la ventana por resultado (una resta por resultado)
+    def totals(self, inicio=None, fin=None, deptos=None, sexos=None, rangos_edad=None, tipos=None,
+               extranjero=None):
+        a, _ = self._window(inicio, fin, deptos, sexos, rangos_edad, tipos, extranjero)
+        return pd.Series(a[-1] - a[0], index=cube.RESULTADOS)
+
+
+def build_prefix(df, version=None):
+    deptos, cod_depto = np.unique(df['Departamento_o_Distrito_'].astype(str).to_numpy(), return_inverse=True)
+
+    fechas = df['fecha_reporte_web']
+    inicio, fin = fechas.min(), fechas.max()
+    dias = pd.date_range(inicio, fin, freq='D')
+    cod_dia = ((fechas - inicio).dt.days).to_numpy()
+    con_fecha = ~np.isnan(cod_dia)
+    cod_dia = np.where(con_fecha, cod_dia, 0).astype(np.int64)
+
+    tipos = sorted(df['Tipo'].dropna().astype(str).unique()) + ['No definido']
+    cod_sexo = cube._codes(df['Sexo'], cube.SEXOS)
+    cod_edad = cube._codes(df['Rango_Edad'].astype(object), cube.RANGOS_EDAD)
+    cod_tipo = cube._codes(df['Tipo'].astype(object), tipos)
+    cod_extranjero = df['Extranjero'].to_numpy(dtype=bool).astype(np.int64)
+    cod_resultado = np.full(df.shape[0], cube.RESULTADOS.index('Activo'), dtype=np.int64)
+    cod_resultado[df['Recuperado'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Recuperado')
+    cod_resultado[df['Falleció'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Fallecido')
+
+    forma = (len(deptos), len(dias), len(cube.SEXOS), len(cube.RANGOS_EDAD), len(tipos),
+             len(EXTRANJERO), len(cube.RESULTADOS))
+    plano = np.ravel_multi_index((cod_depto, cod_dia, cod_sexo, cod_edad, cod_tipo, cod_extranjero,
+                                  cod_resultado), forma)
+    conteos = np.bincount(plano[con_fecha], minlength=int(np.prod(forma))).reshape(forma)
+
+    #Fila de ceros al inicio: acumulados[:, d] son los casos antes del día d
+    acumulados = np.zeros((forma[0], forma[1] + 1) + forma[2:], dtype=np.int32)
+    np.cumsum(conteos, axis=1, out=acumulados[:, 1:])
+    return PrefixCube(acumulados, deptos, dias, tipos, version)
+
+
+#Igual que el cubo: los acumulados en un .npy aparte para abrirlos con mmap
+def save_prefix(prefijos, path):
+    store.save_array(prefijos.acumulados, store.arrays_path(path, 'prefijos', prefijos.version))
+
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, deptos=np.array(prefijos.deptos, dtype=str), dias=prefijos.dias.to_numpy(),
+             tipos=np.array(prefijos.tipos, dtype=str), version=np.array(prefijos.version or '', dtype=str))
+    os.replace(tmp, path)
+
+
+def load_prefix(path, mmap_mode='r'):
+    with np.load(path, allow_pickle=False) as z:
+        version = str(z['version'])
+        acumulados = np.load(store.arrays_path(path, 'prefijos', version), mmap_mode=mmap_mode, allow_pickle=False)
+        return PrefixCube(acumulados, z['deptos'].tolist(), z['dias'], z['tipos'].tolist(), version)
+
+
+#Acumulados de la versión actual de la tabla en cache, se guardan junto a ella
+def load_or_build(df, cache_dir=store.CACHE_DIR):
+    return store.load_or_build_derived(cache_dir, PREFIX_FILE, load_prefix,
+                                       lambda version: build_prefix(store.table(df), version), save_prefix)
@@ -0,0 +1,119 @@
+import os
+import shutil
+import sys
+import time
+import traceback
+
+from covidcol import precompute, store
+
+#Actualización fuera del proceso web: lectura, limpieza, agregados y figuras
+#se generan aquí y se publican como un directorio por versión. La página solo
+#abre (con mmap) la última versión publicada y cambia a la nueva cuando aparece
+SNAPSHOT_DIR = 'dataset/snapshots'
+ACTUAL = 'ACTUAL'
+FIG_SUBDIR = 'figuras'
+
+
+#Versión publicada más reciente, o None si aún no hay ninguna (o si es de un
+#formato de tabla anterior, hasta que se publique una nueva)
+def current_version(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, ACTUAL), encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version if store.read_manifest(os.path.join(snapshot_dir, version)) else None
+
+
+def current_dir(snapshot_dir=SNAPSHOT_DIR):
+    version = current_version(snapshot_dir)
+    return os.path.join(snapshot_dir, version) if version else None
+
+
+#Copia la tabla del cache de trabajo al directorio de la versión. Los archivos
+#del cache nunca se modifican en su lugar (siempre os.replace), así que un
+#enlace duro basta y no duplica el espacio en disco
+def _link_table(cache_dir, destino):
+    os.makedirs(destino)
+    for nombre in os.listdir(cache_dir):
+        origen = os.path.join(cache_dir, nombre)
+        if not os.path.isfile(origen) or '.tmp' in nombre:
+            continue
+        try:
+            os.link(origen, os.path.join(destino, nombre))
+        except OSError:
+            shutil.copy2(origen, os.path.join(destino, nombre))
+
+
+def _publish(snapshot_dir, version):
+    path = os.path.join(snapshot_dir, ACTUAL)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(path + '.tmp', path)
+
+
+#Borra las versiones viejas, dejando la actual y las 'conservar' anteriores
+#(un proceso web puede tener todavía abierta la versión previa)
+def prune(snapshot_dir=SNAPSHOT_DIR, conservar=1):
+    actual = current_version(snapshot_dir)
+    versiones = [v for v in os.listdir(snapshot_dir)
+                 if v != actual and os.path.isdir(os.path.join(snapshot_dir, v))]
+    versiones.sort(key=lambda v: os.path.getmtime(os.path.join(snapshot_dir, v)), reverse=True)
+    for version in versiones[conservar:]:
+        shutil.rmtree(os.path.join(snapshot_dir, version), ignore_errors=True)
+
+
+#Actualiza el cache de trabajo y, si la versión cambió, genera y publica
+#su directorio completo. Devuelve la versión publicada y si es nueva
+def refresh(cache_dir=store.CACHE_DIR, snapshot_dir=SNAPSHOT_DIR, workers=None):
+    store.update(cache_dir)
+    #Directorio de la versión vigente del cache (no cambia aunque otro
+    #proceso actualice el cache mientras se publica)
+    cache_dir = os.path.realpath(cache_dir)
+    version = store.read_manifest(cache_dir)['version']
+    if version == current_version(snapshot_dir):
+        return version, False
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp = os.path.join(snapshot_dir, '.tmp-' + version + '-' + str(os.getpid()))
+    shutil.rmtree(tmp, ignore_errors=True)
+    _link_table(cache_dir, tmp)
+
+    #La tabla se vuelve a abrir desde el directorio nuevo para que el cubo y
+    #las cifras salgan exactamente de los archivos que se publican
+    df = store.load_table(tmp)
+    precompute.precompute_all(df, tmp, os.path.join(tmp, FIG_SUBDIR), workers, current_dir(snapshot_dir))
+    del df
+
+    destino = os.path.join(snapshot_dir, version)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp, destino)
+    _publish(snapshot_dir, version)
+    prune(snapshot_dir)
+    return version, True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Genera y publica una nueva versión de los datos de la página')
+    parser.add_argument('--workers', type=int, default=None, help='número de procesos (por defecto, uno por CPU)')
+    parser.add_argument('--cache-dir', default=store.CACHE_DIR)
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--every', type=int, default=None, help='repite cada N segundos en lugar de terminar')
+    args = parser.parse_args()
+
+    while True:
+        try:
+            version, nueva = refresh(args.cache_dir, args.snapshot_dir, args.workers)
+            print('Versión {} {}'.format(version, 'publicada' if nueva else 'sin cambios'), flush=True)
+        except Exception:
+            #Con --every un error (p.ej. un CSV a medio descargar) no detiene
+            #el proceso de fondo: se registra y se reintenta en la próxima vuelta
+            if not args.every:
+                raise
+            traceback.print_exc()
+            sys.stderr.flush()
+        if not args.every:
+            break
+        time.sleep(args.every)
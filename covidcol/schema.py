@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+#Tipos compactos para la tabla limpia: texto repetido como categoría,
+#'Si'/'No' como booleano y enteros pequeños en lugar de int64/float64
+CATEGORIAS = [
+    'Estado', 'Sexo', 'atención', 'Tipo', 'País_de_procedencia',
+    'Departamento_o_Distrito_', 'Ciudad_de_ubicación', 'Tipo_recuperación',
+]
+BOOLEANOS = ['Recuperado', 'Falleció', 'Extranjero']
+ENTEROS = {
+    'casos': np.int32,
+    'Código_DIVIPOLA': np.int32,
+    'Edad': np.int16,
+    'Días de tratamiento': np.int16,
+}
+FLOTANTES = ['lat', 'lon']
+
+#Columnas crudas o del join que la página no usa
+DESCARTAR = ['Fecha_de_notificación', 'Unnamed: 0', 'dpto_geocode', 'dpto_coords']
+
+
+def compact(data):
+    data = data.drop(columns=[c for c in DESCARTAR if c in data.columns])
+
+    for col in CATEGORIAS:
+        if col in data.columns and not isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].astype('category')
+
+    for col in BOOLEANOS:
+        if col in data.columns and data[col].dtype != bool:
+            data[col] = data[col] == 'Si'
+
+    for col, tipo in ENTEROS.items():
+        if col in data.columns:
+            #Con valores faltantes se deja en flotante de 32 bits
+            if data[col].isnull().any():
+                data[col] = data[col].astype(np.float32)
+            else:
+                data[col] = data[col].astype(tipo)
+
+    for col in FLOTANTES:
+        if col in data.columns:
+            data[col] = data[col].astype(np.float32)
+
+    return data
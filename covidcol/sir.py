@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from covidcol import cube
+
+#Modelo SIR para muchos escenarios (beta, gamma, I0) a la vez: el estado es
+#un arreglo con una fila por escenario y cada paso de Runge-Kutta avanza
+#todos los escenarios con operaciones de NumPy, sin un callback por escenario
+
+#Población total (ver sir_model.ipynb). No tenemos la población por
+#departamento, así que se usa como población susceptible por defecto
+N_COLOMBIA = 48258494
+
+Ajuste = namedtuple('Ajuste', ['beta', 'gamma', 'i0', 'error', 'poblacion'])
+
+
+def _deriv(s, i, beta, gamma, n):
+    contagios = beta * s * i / n
+    recuperaciones = gamma * i
+    return -contagios, contagios - recuperaciones, recuperaciones
+
+
+#Integra el SIR con RK4 para todos los escenarios. beta, gamma e i0 se
+#combinan por broadcasting; devuelve S, I, R con forma (escenarios, dias)
+def simulate(beta, gamma, i0, dias, n=N_COLOMBIA, pasos_por_dia=4):
+    beta, gamma, i0 = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(beta, gamma, i0)]
+    h = 1.0 / pasos_por_dia
+
+    s, i, r = n - i0, i0.copy(), np.zeros_like(i0)
+    S = np.empty((len(beta), dias))
+    I = np.empty_like(S)
+    R = np.empty_like(S)
+
+    for dia in range(dias):
+        S[:, dia], I[:, dia], R[:, dia] = s, i, r
+        for _ in range(pasos_por_dia):
+            k1 = _deriv(s, i, beta, gamma, n)
+            k2 = _deriv(s + h / 2 * k1[0], i + h / 2 * k1[1], beta, gamma, n)
+            k3 = _deriv(s + h / 2 * k2[0], i + h / 2 * k2[1], beta, gamma, n)
+            k4 = _deriv(s + h * k3[0], i + h * k3[1], beta, gamma, n)
+            s = s + h / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0])
+            i = i + h / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])
+            r = r + h / 6 * (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2])
+    return S, I, R
+
+
+#Serie diaria observada desde el primer caso del departamento: casos
+#acumulados, removidos acumulados (recuperados + fallecidos) e infectados activos
+def observed(cubo, depto=None):
+    casos = cube.trim(cubo.series(depto))
+    removidos = (cubo.series(depto, resultado='Recuperado') +
+                 cubo.series(depto, resultado='Fallecido')).loc[casos.index]
+    dg = pd.DataFrame({'Casos': casos.cumsum(), 'Removidos': removidos.cumsum()})
+    dg['Infectados'] = dg['Casos'] - dg['Removidos']
+    return dg
+
+
+#Error de cada escenario contra lo observado: casos acumulados (N - S) y
+#removidos (R), en escala logarítmica para que pesen igual días con pocos y
+#muchos casos
+def _error(S, R, obs, n):
+    casos = np.log1p(obs['Casos'].to_numpy())
+    removidos = np.log1p(obs['Removidos'].to_numpy())
+    return (((np.log1p(np.maximum(n - S, 0)) - casos) ** 2).sum(axis=1) +
+            ((np.log1p(np.maximum(R, 0)) - removidos) ** 2).sum(axis=1))
+
+
+def _grid(betas, gammas, i0s):
+    b, g, i = np.meshgrid(betas, gammas, i0s, indexing='ij')
+    return b.ravel(), g.ravel(), i.ravel()
+
+
+#Ajuste por búsqueda en malla: una malla gruesa de todos los escenarios y
+#luego una más fina alrededor del mejor, cada una en un solo simulate()
+def fit(obs, n=N_COLOMBIA, n_beta=40, n_gamma=40, n_i0=6, refinamientos=2):
+    dias = len(obs)
+    if dias < 2:
+        return Ajuste(np.nan, np.nan, np.nan, np.nan, n)
+
+    betas = np.linspace(0.02, 1.5, n_beta)
+    gammas = np.linspace(0.01, 0.8, n_gamma)
+    i0s = np.geomspace(1, max(obs['Casos'].iloc[0], 1) * 10, n_i0)
+
+    for _ in range(refinamientos + 1):
+        beta, gamma, i0 = _grid(betas, gammas, i0s)
+        S, I, R = simulate(beta, gamma, i0, dias, n)
+        error = _error(S, R, obs, n)
+        mejor = np.nanargmin(error)
+
+        #Malla más fina alrededor del mejor escenario
+        db = (betas[-1] - betas[0]) / max(n_beta - 1, 1)
+        dg = (gammas[-1] - gammas[0]) / max(n_gamma - 1, 1)
+        betas = np.linspace(max(beta[mejor] - db, 1e-4), beta[mejor] + db, n_beta)
+        gammas = np.linspace(max(gamma[mejor] - dg, 1e-4), gamma[mejor] + dg, n_gamma)
+        i0s = np.geomspace(max(i0[mejor] / 2, 1e-2), i0[mejor] * 2, n_i0)
+
+    return Ajuste(beta[mejor], gamma[mejor], i0[mejor], error[mejor], n)
+
+
+#Curvas del modelo ajustado, extendidas 'proyeccion' días después del último dato
+def fitted_curves(obs, ajuste, proyeccion=30):
+    dias = len(obs) + proyeccion
+    index = pd.date_range(obs.index[0], periods=dias, freq='D')
+    if np.isnan(ajuste.beta):
+        return pd.DataFrame(index=index, columns=['Casos', 'Infectados', 'Removidos'], dtype=float)
+    S, I, R = simulate(ajuste.beta, ajuste.gamma, ajuste.i0, dias, ajuste.poblacion)
+    return pd.DataFrame({'Casos': ajuste.poblacion - S[0], 'Infectados': I[0], 'Removidos': R[0]}, index=index)
+
+
+#Ajuste de un departamento, memorizado por (versión de datos, departamento)
+#para que la figura y el texto de la página no ajusten dos veces. Solo se
+#guardan los de la última versión y la clave no es el cubo, así un cubo viejo
+#(y su mmap) no queda vivo en la memoria
+_ajustes = (None, {})
+
+
+def fit_depto(cubo, depto):
+    global _ajustes
+    version, ajustes = _ajustes
+    if version != cubo.version:
+        version, ajustes = _ajustes = (cubo.version, {})
+    if depto not in ajustes:
+        obs = observed(cubo, depto)
+        ajustes[depto] = (obs, fit(obs))
+    return ajustes[depto]
+
+
+#Ajuste para Colombia y cada departamento
+def fit_all(cubo, deptos=None, n=N_COLOMBIA, **kwargs):
+    deptos = ['Colombia'] + sorted(deptos if deptos is not None else cubo.deptos)
+    return {depto: fit(observed(cubo, depto), n, **kwargs) for depto in deptos}
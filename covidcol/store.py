@@ -0,0 +1,505 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from covidcol import data as datos
+from covidcol import dates, schema, timing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#Tabla limpia guardada por columnas (un .npy por columna) para no volver
+#a leer el CSV de 200MB en cada arranque o cada vez que expira el st.cache.
+#Cada versión se escribe en su propio directorio dentro de CACHE_DIR + '.d' y
+#CACHE_DIR es un enlace simbólico a la vigente: cambiarla es reemplazar el
+#enlace, así un lector nunca ve el cache sin manifest
+CACHE_DIR = 'dataset/cache'
+MANIFEST = 'manifest.json'
+FORMATO = 6
+#Versiones anteriores que se conservan además de la vigente (un lector que
+#ya resolvió el enlace puede seguir abriendo sus archivos)
+CONSERVAR = 1
+
+
+def _sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+#Huella de los archivos fuente: mtime/tamaño para decidir rápido y sha1 del
+#contenido para no reconstruir cuando solo cambió la fecha del archivo
+def source_fingerprint(paths, previo=None):
+    previo = previo or {}
+    huella = {}
+    for path in paths:
+        st = os.stat(path)
+        anterior = previo.get(path, {})
+        if anterior.get('mtime') == st.st_mtime and anterior.get('size') == st.st_size:
+            sha1 = anterior['sha1']
+        else:
+            sha1 = _sha1(path)
+        huella[path] = {'mtime': st.st_mtime, 'size': st.st_size, 'sha1': sha1}
+    return huella
+
+
+def data_version(huella):
+    h = hashlib.sha1()
+    for path in sorted(huella):
+        h.update(path.encode('utf-8'))
+        h.update(huella[path]['sha1'].encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def read_manifest(cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('formato') != FORMATO:
+        return None
+    return manifest
+
+
+#Un solo proceso construye o actualiza el cache a la vez (la página y
+#python -m covidcol.refresh pueden arrancar juntos en un dyno nuevo); los
+#demás esperan y después encuentran la versión ya construida
+@contextmanager
+def writer_lock(cache_dir=CACHE_DIR):
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(cache_dir) or '.', exist_ok=True)
+    with open(cache_dir + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+#Apunta cache_dir a 'destino' reemplazando el enlace en un solo paso
+def _point(cache_dir, destino):
+    enlace = cache_dir + '.tmp-enlace-' + str(os.getpid())
+    if os.path.lexists(enlace):
+        os.remove(enlace)
+    os.symlink(os.path.relpath(destino, os.path.dirname(cache_dir) or '.'), enlace)
+    if os.path.isdir(cache_dir) and not os.path.islink(cache_dir):
+        #Cache de antes de los enlaces: se mueve junto a las versiones
+        os.replace(cache_dir, os.path.join(os.path.dirname(destino), 'anterior-' + str(os.getpid())))
+    os.replace(enlace, cache_dir)
+
+
+def _prune(versiones_dir, actual, conservar=CONSERVAR):
+    versiones = [os.path.join(versiones_dir, v) for v in os.listdir(versiones_dir) if not v.startswith('.tmp-')]
+    versiones = [v for v in versiones if os.path.isdir(v) and os.path.realpath(v) != os.path.realpath(actual)]
+    versiones.sort(key=os.path.getmtime, reverse=True)
+    for version in versiones[conservar:]:
+        shutil.rmtree(version, ignore_errors=True)
+
+
+def _write_manifest(cache_dir, manifest):
+    tmp = tmp_path(os.path.join(cache_dir, MANIFEST))
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(cache_dir, MANIFEST))
+
+
+#Escribe la tabla por bloques: cada columna se agrega a un archivo binario
+#y al final se convierte en .npy, así la memoria no depende del total de filas
+class TableWriter:
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.versiones_dir = cache_dir + '.d'
+        self.tmp_dir = os.path.join(self.versiones_dir, '.tmp-' + str(os.getpid()))
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.columnas = []
+        self.filas = 0
+
+    def _new_column(self, i, nombre, serie):
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            tipo, meta = 'category', {'categorias': [], 'ordenada': bool(serie.cat.ordered)}
+            dtype = np.dtype(np.int32)
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            tipo, meta, dtype = 'datetime', {}, np.dtype('datetime64[ns]')
+        elif pd.api.types.is_bool_dtype(serie) or pd.api.types.is_numeric_dtype(serie):
+            tipo, meta, dtype = 'numeric', {}, serie.dtype
+        else:
+            #Texto: se guarda como códigos + diccionario de valores
+            tipo, meta = 'object', {'categorias': []}
+            dtype = np.dtype(np.int32)
+        return {'nombre': nombre, 'archivo': 'c{:03d}.npy'.format(i), 'tipo': tipo, 'meta': meta,
+                'dtype': dtype, 'posicion': {}}
+
+    def _bin(self, col):
+        return os.path.join(self.tmp_dir, col['archivo'] + '.bin')
+
+    #Códigos de este bloque traducidos al diccionario global de la columna
+    def _encode(self, col, serie):
+        if col['tipo'] == 'category':
+            codes, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+        else:
+            codes, valores = pd.factorize(serie)
+        posicion = col['posicion']
+        for valor in valores:
+            valor = valor if col['tipo'] == 'category' else str(valor)
+            if valor not in posicion:
+                posicion[valor] = len(col['meta']['categorias'])
+                col['meta']['categorias'].append(valor)
+        valores = valores if col['tipo'] == 'category' else [str(v) for v in valores]
+        mapa = np.array([posicion[v] for v in valores] + [-1], dtype=np.int32)
+        return mapa[codes]
+
+    #Si un bloque trae un tipo más amplio (p.ej. Edad con vacíos) se
+    #convierte lo ya escrito, también por bloques
+    def _promote(self, col, dtype):
+        viejo = self._bin(col)
+        nuevo = viejo + '.tmp'
+        with open(viejo, 'rb') as fin, open(nuevo, 'wb') as fout:
+            while True:
+                bloque = np.fromfile(fin, dtype=col['dtype'], count=1 << 20)
+                if len(bloque) == 0:
+                    break
+                bloque.astype(dtype).tofile(fout)
+        os.replace(nuevo, viejo)
+        col['dtype'] = dtype
+
+    def append(self, df):
+        if not self.columnas:
+            self.columnas = [self._new_column(i, nombre, df[nombre]) for i, nombre in enumerate(df.columns)]
+        for col in self.columnas:
+            serie = df[col['nombre']]
+            if col['tipo'] in ('category', 'object'):
+                valores = self._encode(col, serie)
+            elif col['tipo'] == 'datetime':
+                valores = serie.to_numpy(dtype='datetime64[ns]')
+            else:
+                valores = serie.to_numpy()
+                dtype = np.result_type(col['dtype'], valores.dtype)
+                if dtype != col['dtype']:
+                    self._promote(col, dtype)
+                valores = valores.astype(col['dtype'], copy=False)
+            with open(self._bin(col), 'ab') as f:
+                valores.tofile(f)
+        self.filas += df.shape[0]
+
+    def _finish_column(self, col):
+        path = os.path.join(self.tmp_dir, col['archivo'])
+        with open(path, 'wb') as fout:
+            np.lib.format.write_array_header_1_0(fout, {
+                'descr': np.lib.format.dtype_to_descr(col['dtype']),
+                'fortran_order': False,
+                'shape': (self.filas,),
+            })
+            if os.path.exists(self._bin(col)):
+                with open(self._bin(col), 'rb') as fin:
+                    shutil.copyfileobj(fin, fout, 1 << 20)
+        if os.path.exists(self._bin(col)):
+            os.remove(self._bin(col))
+
+    #Escribe el manifest, mueve la tabla a su directorio y cambia el enlace
+    #de una sola vez para que un lector nunca vea una tabla a medio escribir
+    def commit(self, version, huella, version_fuentes=None, fechas_invalidas=None):
+        for col in self.columnas:
+            self._finish_column(col)
+
+        _write_manifest(self.tmp_dir, {
+            'formato': FORMATO,
+            'version': version,
+            'version_fuentes': version_fuentes or version,
+            'fuentes': huella,
+            'filas': self.filas,
+            'fechas_invalidas': fechas_invalidas or {},
+            'columnas': [{k: col[k] for k in ('nombre', 'archivo', 'tipo', 'meta')} for col in self.columnas],
+        })
+
+        destino = os.path.join(self.versiones_dir, '{}-{:x}'.format(version, time.time_ns()))
+        os.replace(self.tmp_dir, destino)
+        _point(self.cache_dir, destino)
+        _prune(self.versiones_dir, destino)
+
+
+def _decode_column(tipo, valores, meta):
+    if tipo == 'category':
+        return pd.Categorical.from_codes(valores, meta['categorias'], ordered=meta['ordenada'])
+    if tipo == 'object':
+        categorias = np.array(meta['categorias'] + [np.nan], dtype=object)
+        return categorias[valores]
+    return valores
+
+
+def save_table(df, version, huella, cache_dir=CACHE_DIR, version_fuentes=None, fechas_invalidas=None):
+    writer = TableWriter(cache_dir)
+    writer.append(df)
+    writer.commit(version, huella, version_fuentes, fechas_invalidas)
+
+
+#Construye la tabla limpia leyendo el CSV por bloques: cada bloque se
+#corrige (DIVIPOLA, textos, fechas) y se agrega al cache por columnas
+def build_streaming(version, huella, cache_dir=CACHE_DIR, fuentes=None, chunksize=datos.CHUNKSIZE):
+    fuentes = fuentes or datos.FUENTES
+    lookups = datos.read_lookups(*fuentes[1:])
+    writer = TableWriter(cache_dir)
+    fechas_invalidas = {}
+    timing.marca('tablas_auxiliares')
+    for raw in datos.read_raw_chunks(fuentes[0], chunksize):
+        timing.marca('lectura')
+        hash_fila = datos.row_hash(raw)
+        timing.marca('hash_filas')
+        data = datos.clean_data(raw, *lookups, reporte=fechas_invalidas)
+        data['hash_fila'] = hash_fila
+        writer.append(data)
+        timing.marca('escritura')
+    writer.commit(version, huella, fechas_invalidas=fechas_invalidas)
+    timing.marca('escritura')
+
+
+def load_table(cache_dir=CACHE_DIR, manifest=None):
+    #El enlace se resuelve una vez: manifest y columnas salen de la misma versión
+    cache_dir = os.path.realpath(cache_dir) if manifest is None else cache_dir
+    manifest = manifest or read_manifest(cache_dir)
+    df = _decode_rows(manifest, _open_columns(cache_dir, manifest))
+    timing.marca('carga_tabla')
+    return df
+
+
+#Una sola columna de la tabla, abierta con mmap y sin cargar las demás
+def load_column(nombre, cache_dir=CACHE_DIR, manifest=None):
+    cache_dir = os.path.realpath(cache_dir) if manifest is None else cache_dir
+    manifest = manifest or read_manifest(cache_dir)
+    col = next(c for c in manifest['columnas'] if c['nombre'] == nombre)
+    valores = np.load(os.path.join(cache_dir, col['archivo']), mmap_mode='r', allow_pickle=False)
+    return _decode_column(col['tipo'], valores, col['meta'])
+
+
+#Columnas de una versión guardada abiertas con mmap, sin copiarlas
+def _open_columns(cache_dir, manifest):
+    return {col['nombre']: np.load(os.path.join(cache_dir, col['archivo']), mmap_mode='r', allow_pickle=False)
+            for col in manifest['columnas']}
+
+
+#Tabla con las filas dadas (o todas) de las columnas abiertas
+def _decode_rows(manifest, columnas, filas=None):
+    datos_filas = {}
+    for col in manifest['columnas']:
+        valores = columnas[col['nombre']]
+        datos_filas[col['nombre']] = _decode_column(col['tipo'], valores if filas is None else valores[filas],
+                                                    col['meta'])
+    return pd.DataFrame(datos_filas, columns=[c['nombre'] for c in manifest['columnas']])
+
+
+#Derivados de la tabla (cubo, prefijos, municipios, crecimiento...): se
+#guardan junto a ella con la versión de los datos con la que se construyeron
+
+#Arreglo grande de un derivado en un .npy aparte (con la versión en el
+#nombre) para abrirlo con mmap desde varios procesos sin copiarlo
+def arrays_path(path, nombre, version):
+    return os.path.join(os.path.dirname(path), nombre + '-' + (version or 'sin-version') + '.npy')
+
+
+def save_array(arreglo, path):
+    tmp = tmp_path(path, '.npy')
+    np.save(tmp, arreglo)
+    os.replace(tmp, path)
+
+
+#Temporal único por proceso e hilo: la página y el pre-render (u otro
+#proceso) pueden construir el mismo derivado a la vez sin pisarse el temporal
+def tmp_path(path, extension=''):
+    return '{}.tmp-{}-{}{}'.format(path, os.getpid(), threading.get_ident(), extension)
+
+
+#La tabla se puede pasar ya cargada o como función que la carga: quien solo
+#necesita un derivado ya guardado no abre la tabla
+def table(df):
+    return df() if callable(df) else df
+
+
+#Derivado de la versión actual de cache_dir (o de 'version'): se abre de
+#'archivo' con load(path) si es de esa versión; si no, se construye con
+#build(version) y se guarda con save(objeto, path)
+def load_or_build_derived(cache_dir, archivo, load, build, save, version=None):
+    cache_dir = os.path.realpath(cache_dir)
+    if version is None:
+        manifest = read_manifest(cache_dir)
+        version = manifest['version'] if manifest else None
+    path = os.path.join(cache_dir, archivo)
+    if version and os.path.exists(path):
+        objeto = load(path)
+        if objeto.version == version:
+            return objeto
+    objeto = build(version)
+    if version:
+        save(objeto, path)
+    return objeto
+
+
+#Upsert por id de caso: los casos nuevos se agregan y los existentes se
+#reemplazan. El CSV se recorre por bloques y solo se limpian las filas nuevas
+#o cuyo registro crudo cambió. La versión anterior (cache_dir, manifest) se
+#abre con mmap y se copia a writer por bloques, ordenada por id y junto con
+#esas filas, así en memoria solo quedan los ids y hashes de los casos y las
+#filas que cambiaron, no la tabla. En reporte (los conteos de fechas no
+#válidas de la versión anterior) se restan los casos que salen y se suman los
+#nuevos. Devuelve cuántas filas cambiaron
+def upsert_rows(cache_dir, manifest, chunks, lookups, writer, snapshot=False, reporte=None,
+                bloque=datos.CHUNKSIZE):
+    columnas = _open_columns(cache_dir, manifest)
+    casos = columnas['casos']
+    #Una tabla que ya pasó por un upsert está ordenada y no se copia
+    orden = None if np.all(casos[1:] >= casos[:-1]) else np.argsort(casos, kind='stable')
+    casos = casos if orden is None else casos[orden]
+    hash_previo = columnas['hash_fila'] if orden is None else columnas['hash_fila'][orden]
+
+    cambios, ids = [], []
+    for raw in chunks:
+        id_caso = raw['casos'].to_numpy()
+        if snapshot:
+            ids.append(id_caso)
+        hash_fila = datos.row_hash(raw)
+        pos = np.minimum(np.searchsorted(casos, id_caso), max(len(casos) - 1, 0))
+        igual = (casos[pos] == id_caso) & (hash_previo[pos] == hash_fila) if len(casos) \
+            else np.zeros(len(id_caso), dtype=bool)
+        raw = raw[~igual].copy()
+        raw['hash_fila'] = hash_fila[~igual]
+        cambios.append(raw)
+
+    nuevos = datos.clean_data(pd.concat(cambios, ignore_index=True), *lookups, reporte=reporte)
+    nuevos = nuevos.sort_values('casos', kind='mergesort', ignore_index=True)[list(columnas)]
+    timing.marca('diff_casos')
+
+    #Con un corte completo se descartan los casos que ya no aparecen
+    conservar = ~np.isin(casos, nuevos['casos'].to_numpy())
+    if snapshot:
+        conservar &= np.isin(casos, np.concatenate(ids))
+    del ids
+    if reporte is not None:
+        salen = np.flatnonzero(~conservar) if orden is None else orden[~conservar]
+        for col, n in dates.count_invalid(columnas['fechas_invalidas'][salen]).items():
+            reporte[col] = reporte.get(col, 0) - n
+
+    #Cada bloque de la tabla anterior se escribe con las filas nuevas cuyo id
+    #no pasa del último del bloque (el último bloque se lleva las que sobran)
+    casos_nuevos = nuevos['casos'].to_numpy()
+    i_nuevos = 0
+    for inicio in range(0, max(len(casos), 1), bloque):
+        fin = min(inicio + bloque, len(casos))
+        hasta = len(nuevos) if fin == len(casos) else int(np.searchsorted(casos_nuevos, casos[fin - 1], side='right'))
+        filas = inicio + np.flatnonzero(conservar[inicio:fin])
+        filas = filas if orden is None else orden[filas]
+        data = pd.concat([_decode_rows(manifest, columnas, filas), nuevos.iloc[i_nuevos:hasta]], ignore_index=True)
+        i_nuevos = hasta
+        data = data.sort_values('casos', kind='mergesort', ignore_index=True)
+        #concat de categorías distintas deja texto, se vuelve a compactar
+        writer.append(schema.compact(data))
+    timing.marca('escritura')
+    return nuevos.shape[0]
+
+
+def _delta_version(version, delta_sha1):
+    return hashlib.sha1((version + delta_sha1).encode('utf-8')).hexdigest()[:16]
+
+
+#Aplica un archivo delta (mismo formato del CSV del INS, solo filas nuevas o
+#actualizadas) sobre la tabla en cache
+def apply_delta(delta_csv, cache_dir=CACHE_DIR, fuentes=None):
+    fuentes = fuentes or datos.FUENTES
+    with writer_lock(cache_dir):
+        return _apply_delta(delta_csv, cache_dir, fuentes)
+
+
+def _apply_delta(delta_csv, cache_dir, fuentes):
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        _update(cache_dir, fuentes)
+        manifest = read_manifest(cache_dir)
+
+    chunks = datos.read_raw_chunks(delta_csv)
+    fechas_invalidas = dict(manifest['fechas_invalidas'])
+    writer = TableWriter(cache_dir)
+    cambios = upsert_rows(os.path.realpath(cache_dir), manifest, chunks, datos.read_lookups(*fuentes[1:]), writer,
+                          reporte=fechas_invalidas)
+
+    version = _delta_version(manifest['version'], _sha1(delta_csv))
+    writer.commit(version, manifest['fuentes'], manifest['version_fuentes'], fechas_invalidas)
+    return writer.filas, cambios
+
+
+#Carga la tabla limpia desde el cache, reconstruyéndola solo si los
+#archivos fuente cambiaron
+def load_or_build(cache_dir=CACHE_DIR, fuentes=None):
+    fuentes = fuentes or datos.FUENTES
+    with writer_lock(cache_dir):
+        _update(cache_dir, fuentes)
+        return load_table(cache_dir)
+
+
+#Igual que load_or_build pero sin cargar la tabla si ya está al día;
+#devuelve la versión vigente
+def update(cache_dir=CACHE_DIR, fuentes=None):
+    fuentes = fuentes or datos.FUENTES
+    with writer_lock(cache_dir):
+        _update(cache_dir, fuentes)
+        return read_manifest(cache_dir)['version']
+
+
+#Actualiza el cache si los archivos fuente cambiaron
+def _update(cache_dir, fuentes):
+    manifest = read_manifest(cache_dir)
+    previo = manifest['fuentes'] if manifest else None
+    huella = source_fingerprint(fuentes, previo)
+    version = data_version(huella)
+    timing.marca('huella_fuentes')
+
+    if manifest and manifest['version_fuentes'] == version:
+        if huella != previo:
+            #Mismo contenido con otra fecha de modificación
+            manifest['fuentes'] = huella
+            _write_manifest(cache_dir, manifest)
+        return
+
+    #Nuevo corte del INS con las mismas tablas auxiliares: diff por id de caso
+    csv_casos = fuentes[0]
+    if manifest and all(huella[p]['sha1'] == previo.get(p, {}).get('sha1') for p in fuentes[1:]):
+        chunks = datos.read_raw_chunks(csv_casos)
+        fechas_invalidas = dict(manifest['fechas_invalidas'])
+        writer = TableWriter(cache_dir)
+        upsert_rows(os.path.realpath(cache_dir), manifest, chunks, datos.read_lookups(*fuentes[1:]), writer,
+                    snapshot=True, reporte=fechas_invalidas)
+        writer.commit(version, huella, fechas_invalidas=fechas_invalidas)
+        timing.marca('escritura')
+        return
+
+    build_streaming(version, huella, cache_dir, fuentes)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Actualiza la tabla limpia en cache')
+    parser.add_argument('--delta', help='CSV del INS solo con casos nuevos o actualizados')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.delta:
+        filas, cambios = apply_delta(args.delta, args.cache_dir)
+        print('{:,} casos actualizados, {:,} casos en total'.format(cambios, filas))
+    else:
+        data = load_or_build(args.cache_dir)
+        print('{:,} casos en total'.format(data.shape[0]))
+        for col, n in read_manifest(args.cache_dir).get('fechas_invalidas', {}).items():
+            print('{}: {:,} fechas no válidas (NaT)'.format(col, n))
@@ -0,0 +1,251 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidcol import cube, kpis, store
+
+#Tiempo hasta la recuperación y hasta la muerte por departamento y rango de
+#edad, contado desde la fecha de inicio de síntomas (FIS, o la de reporte si
+#no tiene) hasta Fecha_recuperado o Fecha_de_muerte. Se guardan histogramas
+#por día (el último día agrupa DIAS o más) y los casos activos por día de
+#inicio; como la fecha de corte cambia en cada versión, su tiempo en
+#seguimiento se calcula al consultar. Las curvas de Kaplan-Meier y los
+#cuantiles salen de los histogramas, sin recorrer la tabla
+SURVIVAL_FILE = 'supervivencia.npz'
+#Código de cada caso, para actualizar los histogramas solo con los casos
+#nuevos o modificados en la siguiente versión
+FILAS_FILE = 'supervivencia-filas.npz'
+
+DIAS = 180
+ORIGEN = pd.Timestamp('2020-01-01')
+DESENLACES = ['Recuperado', 'Fallecido']
+CUANTILES = [0.25, 0.5, 0.75]
+
+
+class Survival:
+
+    def __init__(self, eventos, activos, deptos, corte, version, filas=None):
+        self.eventos = eventos  # (depto, edad, desenlace, días hasta el desenlace)
+        self.activos = activos  # (depto, edad, días desde ORIGEN hasta el inicio)
+        self.deptos = list(deptos)
+        self.corte = pd.Timestamp(corte)
+        self.version = version
+        self.filas = filas      # códigos por caso (solo al construir o actualizar)
+        self._pos = {d: i for i, d in enumerate(self.deptos)}
+
+    def _deptos(self, depto):
+        if depto is None or depto == 'Colombia':
+            return slice(None)
+        return [self._pos[depto]] if depto in self._pos else []
+
+    def _edades(self, rango_edad):
+        return slice(None) if rango_edad is None else [cube.RANGOS_EDAD.index(rango_edad)]
+
+    #Histogramas (desenlace, día) de eventos y de activos en seguimiento
+    #(censurados en el día de corte)
+    def histograms(self, depto=None, rango_edad=None):
+        eventos = self.eventos[self._deptos(depto)][:, self._edades(rango_edad)].sum(axis=(0, 1))
+        activos = self.activos[self._deptos(depto)][:, self._edades(rango_edad)].sum(axis=(0, 1))
+        dias = (self.corte - ORIGEN).days - np.arange(len(activos))
+        con_dias = dias >= 0
+        censurados = np.bincount(np.minimum(dias[con_dias], DIAS), weights=activos[con_dias],
+                                 minlength=DIAS + 1)
+        return np.asarray(eventos, dtype=np.int64), censurados.astype(np.int64)
+
+    #Kaplan-Meier de un desenlace: el otro desenlace y los activos se
+    #censuran. Devuelve la fracción que aún no llega al desenlace por día
+    def curve(self, depto=None, desenlace='Recuperado', rango_edad=None):
+        eventos, censurados = self.histograms(depto, rango_edad)
+        d = eventos[DESENLACES.index(desenlace)]
+        salen = eventos.sum(axis=0) + censurados
+        en_riesgo = salen.sum() - np.concatenate([[0], np.cumsum(salen)[:-1]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            supervivencia = np.cumprod(np.where(en_riesgo > 0, 1 - d / en_riesgo, 1.0))
+        dg = pd.DataFrame({'Supervivencia': supervivencia, 'En riesgo': en_riesgo, 'Eventos': d},
+                          index=pd.RangeIndex(DIAS + 1, name='Días'))
+        return dg
+
+    #Curvas de todos los rangos de edad (y 'Todos') de un departamento
+    def curves(self, depto=None, desenlace='Recuperado'):
+        curvas = {'Todos': self.curve(depto, desenlace)['Supervivencia']}
+        for rango in cube.RANGOS_EDAD:
+            curvas[rango] = self.curve(depto, desenlace, rango)['Supervivencia']
+        return pd.DataFrame(curvas)
+
+    #Primer día en que la curva baja a 1 - q (NaN si no llega)
+    def quantiles(self, depto=None, desenlace='Recuperado', rango_edad=None, cuantiles=CUANTILES):
+        supervivencia = self.curve(depto, desenlace, rango_edad)['Supervivencia'].to_numpy()
+        valores = []
+        for q in cuantiles:
+            llega = np.flatnonzero(supervivencia <= 1 - q + 1e-12)
+            valores.append(float(llega[0]) if len(llega) else np.nan)
+        return pd.Series(valores, index=cuantiles)
+
+    #Cuantiles por rango de edad, una fila por rango
+    def quantiles_by_age(self, depto=None, desenlace='Recuperado', cuantiles=CUANTILES):
+        filas = {'Todos': self.quantiles(depto, desenlace, None, cuantiles)}
+        for rango in cube.RANGOS_EDAD:
+            filas[rango] = self.quantiles(depto, desenlace, rango, cuantiles)
+        return pd.DataFrame(filas).T
+
+    #Mínimo, máximo, mediana y moda de los días de los casos que ya llegaron
+    #al desenlace (como las cifras de tratamiento de kpis.py)
+    def observed(self, depto=None, desenlace='Recuperado', rango_edad=None):
+        eventos, _ = self.histograms(depto, rango_edad)
+        hist = eventos[DESENLACES.index(desenlace)][None, :]
+        return pd.Series({'casos': int(hist.sum()), 'min': kpis._min(hist)[0], 'max': kpis._max(hist)[0],
+                          'mediana': kpis._median(hist)[0], 'moda': kpis._mode(hist)[0]})
+
+
+#Código de cada caso: departamento, rango de edad, resultado y día (días hasta
+#el desenlace, o día de inicio desde ORIGEN para los activos; -1 sin fecha válida)
+def _codes(df, deptos):
+    cod_depto = pd.Categorical(df['Departamento_o_Distrito_'].astype(str), categories=deptos).codes
+    cod_edad = cube._codes(df['Rango_Edad'].astype(object), cube.RANGOS_EDAD)
+    cod_resultado = np.full(df.shape[0], cube.RESULTADOS.index('Activo'), dtype=np.int64)
+    cod_resultado[df['Recuperado'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Recuperado')
+    cod_resultado[df['Falleció'].to_numpy(dtype=bool)] = cube.RESULTADOS.index('Fallecido')
+
+    inicio = df['FIS'].fillna(df['fecha_reporte_web'])
+    fin = df['Fecha_recuperado'].where(df['Recuperado'].to_numpy(dtype=bool), df['Fecha_de_muerte'])
+    dias = (fin - inicio).dt.days.to_numpy()
+    dias_inicio = (inicio - ORIGEN).dt.days.to_numpy()
+    activo = cod_resultado == cube.RESULTADOS.index('Activo')
+    dias = np.where(activo, dias_inicio, np.minimum(dias, DIAS))
+    dias = np.where(np.isnan(dias) | (dias < 0), -1, dias).astype(np.int32)
+    return cod_depto.astype(np.int16), cod_edad.astype(np.int8), cod_resultado.astype(np.int8), dias
+
+
+#Suma (o resta) los casos con esos códigos a los histogramas
+def _add(eventos, activos, cod_depto, cod_edad, cod_resultado, dias, signo=1):
+    validos = dias >= 0
+    activo = cod_resultado == cube.RESULTADOS.index('Activo')
+
+    m = validos & ~activo
+    plano = np.ravel_multi_index((cod_depto[m], cod_edad[m], cod_resultado[m], dias[m]), eventos.shape)
+    eventos += signo * np.bincount(plano, minlength=eventos.size).reshape(eventos.shape).astype(eventos.dtype)
+
+    m = validos & activo
+    plano = np.ravel_multi_index((cod_depto[m], cod_edad[m], dias[m]), activos.shape)
+    activos += signo * np.bincount(plano, minlength=activos.size).reshape(activos.shape).astype(activos.dtype)
+
+
+def _filas(df, orden, codigos):
+    return {'casos': df['casos'].to_numpy()[orden], 'hash_fila': df['hash_fila'].to_numpy()[orden],
+            'depto': codigos[0][orden], 'edad': codigos[1][orden], 'resultado': codigos[2][orden],
+            'dias': codigos[3][orden]}
+
+
+def _dias_inicio(dias, resultado):
+    activos = dias[resultado == cube.RESULTADOS.index('Activo')]
+    return int(activos.max(initial=-1)) + 1
+
+
+def build_survival(df, version=None):
+    deptos = sorted(df['Departamento_o_Distrito_'].astype(str).unique())
+    codigos = _codes(df, deptos)
+    eventos = np.zeros((len(deptos), len(cube.RANGOS_EDAD), len(DESENLACES), DIAS + 1), dtype=np.int32)
+    activos = np.zeros((len(deptos), len(cube.RANGOS_EDAD), _dias_inicio(codigos[3], codigos[2])), dtype=np.int32)
+    _add(eventos, activos, *codigos)
+    orden = np.argsort(df['casos'].to_numpy(), kind='stable')
+    return Survival(eventos, activos, deptos, df['fecha_reporte_web'].max(), version, _filas(df, orden, codigos))
+
+
+#Versión nueva a partir de la anterior: los casos que desaparecieron o
+#cambiaron (hash_fila distinto) se restan y solo los nuevos o modificados se
+#vuelven a codificar y se suman
+def update_survival(anterior, filas, df, version=None):
+    orden = np.argsort(df['casos'].to_numpy(), kind='stable')
+    casos = df['casos'].to_numpy()[orden]
+    hash_fila = df['hash_fila'].to_numpy()[orden]
+    pos = np.minimum(np.searchsorted(filas['casos'], casos), max(len(filas['casos']) - 1, 0))
+    igual = (filas['casos'][pos] == casos) & (filas['hash_fila'][pos] == hash_fila) if len(filas['casos']) \
+        else np.zeros(len(casos), dtype=bool)
+
+    deptos = list(anterior.deptos)
+    nuevos_deptos = sorted(set(df['Departamento_o_Distrito_'].astype(str).unique()) - set(deptos))
+    deptos += nuevos_deptos
+    cambios = df.iloc[orden[~igual]]
+    cod_cambios = _codes(cambios, deptos)
+
+    #Los histogramas crecen si hay departamentos o días de inicio nuevos
+    eventos = np.zeros((len(deptos),) + anterior.eventos.shape[1:], dtype=np.int32)
+    eventos[:len(anterior.deptos)] = anterior.eventos
+    n_inicio = max(anterior.activos.shape[2], _dias_inicio(cod_cambios[3], cod_cambios[2]))
+    activos = np.zeros((len(deptos), anterior.activos.shape[1], n_inicio), dtype=np.int32)
+    activos[:len(anterior.deptos), :, :anterior.activos.shape[2]] = anterior.activos
+
+    quitar = np.ones(len(filas['casos']), dtype=bool)
+    quitar[pos[igual]] = False
+    _add(eventos, activos, filas['depto'][quitar], filas['edad'][quitar], filas['resultado'][quitar],
+         filas['dias'][quitar], signo=-1)
+    _add(eventos, activos, *cod_cambios)
+
+    nuevas = {}
+    for col in filas:
+        valores = np.empty(len(casos), dtype=filas[col].dtype)
+        valores[igual] = filas[col][pos[igual]]
+        nuevas[col] = valores
+    nuevas['casos'][~igual] = casos[~igual]
+    nuevas['hash_fila'][~igual] = hash_fila[~igual]
+    for col, valores in zip(['depto', 'edad', 'resultado', 'dias'], cod_cambios):
+        nuevas[col][~igual] = valores
+
+    return Survival(eventos, activos, deptos, df['fecha_reporte_web'].max(), version, nuevas)
+
+
+def save_survival(supervivencia, path):
+    tmp = store.tmp_path(path, '.npz')
+    np.savez(tmp, eventos=supervivencia.eventos, activos=supervivencia.activos,
+             deptos=np.array(supervivencia.deptos, dtype=str),
+             corte=np.array(supervivencia.corte.to_datetime64()),
+             version=np.array(supervivencia.version or '', dtype=str))
+    os.replace(tmp, path)
+
+    if supervivencia.filas is not None:
+        path_filas = os.path.join(os.path.dirname(path), FILAS_FILE)
+        tmp = store.tmp_path(path_filas, '.npz')
+        np.savez(tmp, version=np.array(supervivencia.version or '', dtype=str), **supervivencia.filas)
+        os.replace(tmp, path_filas)
+
+
+def load_survival(path):
+    with np.load(path, allow_pickle=False) as z:
+        return Survival(z['eventos'], z['activos'], z['deptos'].tolist(), z['corte'][()], str(z['version']))
+
+
+def load_filas(path):
+    with np.load(path, allow_pickle=False) as z:
+        return str(z['version']), {k: z[k] for k in z.files if k != 'version'}
+
+
+#Versión nueva desde la anterior de alguno de los directorios (la que tenga
+#también los códigos por caso); si no hay ninguna, desde cero
+def _build(df, version, directorios):
+    df = store.table(df)
+    for directorio in directorios:
+        previo = os.path.join(directorio, SURVIVAL_FILE) if directorio else None
+        if previo and os.path.exists(previo) and os.path.exists(os.path.join(directorio, FILAS_FILE)):
+            anterior = load_survival(previo)
+            version_filas, filas = load_filas(os.path.join(directorio, FILAS_FILE))
+            if version_filas == anterior.version:
+                return update_survival(anterior, filas, df, version)
+    return build_survival(df, version)
+
+
+#Una vez guardados, los códigos por caso (unos 20 bytes por fila) solo
+#sirven para la próxima actualización y no se conservan en memoria ni se
+#pasan a otros procesos
+def _save(supervivencia, path):
+    save_survival(supervivencia, path)
+    supervivencia.filas = None
+
+
+#Histogramas de la versión actual de la tabla en cache, se guardan junto a
+#ella. Si hay una versión anterior (en cache_dir o en anterior_dir, p.ej. la
+#última versión publicada) solo se procesan los casos que cambiaron
+def load_or_build(df, cache_dir=store.CACHE_DIR, anterior_dir=None):
+    return store.load_or_build_derived(cache_dir, SURVIVAL_FILE, load_survival,
+                                       lambda version: _build(df, version, (cache_dir, anterior_dir)),
+                                       _save)
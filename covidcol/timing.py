@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Cronómetro por etapas: cada marca() cierra la etapa que empezó en la marca
+#anterior y guarda su tiempo real, su tiempo de CPU y la memoria. La memoria
+#asignada y el pico de la etapa solo se miden si tracemalloc está activo (es
+#más lento); la memoria máxima del proceso (RSS) se toma siempre que exista
+#'resource'
+
+#Instrumentación de la página: COVIDCOL_TIMING=1 (tiempos) o
+#COVIDCOL_TIMING=memoria (tiempos y tracemalloc). Cada ejecución se escribe
+#como una línea JSON en COVIDCOL_TIMING_LOG, o en stdout si no está definida
+ENV = 'COVIDCOL_TIMING'
+ENV_LOG = 'COVIDCOL_TIMING_LOG'
+
+
+def _rss_max_mb():
+    if resource is None:
+        return None
+    #ru_maxrss viene en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Etapas:
+
+    def __init__(self):
+        self.etapas = []
+        self.reinicia()
+
+    #Empieza una etapa nueva sin guardar la anterior
+    def reinicia(self):
+        if tracemalloc.is_tracing():
+            self._memoria = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def marca(self, nombre, **extra):
+        etapa = {
+            'etapa': nombre,
+            'segundos': time.perf_counter() - self._wall,
+            'cpu_segundos': time.process_time() - self._cpu,
+            'asignado_mb': None,
+            'pico_mb': None,
+            'rss_max_mb': _rss_max_mb(),
+        }
+        if tracemalloc.is_tracing():
+            actual, pico = tracemalloc.get_traced_memory()
+            etapa['asignado_mb'] = (actual - self._memoria) / 2 ** 20
+            etapa['pico_mb'] = pico / 2 ** 20
+        etapa.update(extra)
+        self.etapas.append(etapa)
+        self.reinicia()
+        return etapa
+
+    def total(self):
+        return sum(e['segundos'] for e in self.etapas)
+
+    #Etapas con el mismo nombre (p.ej. un bloque del CSV) sumadas en una fila
+    def resumen(self):
+        filas = OrderedDict()
+        for e in self.etapas:
+            fila = filas.setdefault(e['etapa'], {'etapa': e['etapa'], 'veces': 0, 'segundos': 0.0,
+                                                 'cpu_segundos': 0.0, 'asignado_mb': None, 'pico_mb': None})
+            fila['veces'] += 1
+            fila['segundos'] += e['segundos']
+            fila['cpu_segundos'] += e['cpu_segundos']
+            if e['asignado_mb'] is not None:
+                fila['asignado_mb'] = (fila['asignado_mb'] or 0) + e['asignado_mb']
+                fila['pico_mb'] = max(fila['pico_mb'] or 0, e['pico_mb'])
+        return list(filas.values())
+
+    #Una línea JSON con todas las etapas y el contexto (departamento, versión...)
+    def to_jsonl(self, path=None, **contexto):
+        linea = dict(contexto, ts=time.time(), segundos=self.total(), rss_max_mb=_rss_max_mb(),
+                     etapas=self.etapas)
+        texto = json.dumps(linea, ensure_ascii=False, default=str)
+        if path:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(texto + '\n')
+        else:
+            print(texto, file=sys.stdout, flush=True)
+
+
+#Etapas activas en el hilo actual. Streamlit corre cada sesión en su propio
+#hilo, así que funciones en st.cache pueden marcar etapas sin recibirlas
+#como argumento (y sin cambiar la llave del cache)
+_local = threading.local()
+
+
+def actual():
+    return getattr(_local, 'etapas', None)
+
+
+def activa(etapas):
+    _local.etapas = etapas
+
+
+def marca(nombre, **extra):
+    etapas = actual()
+    if etapas is not None:
+        etapas.marca(nombre, **extra)
+
+
+def reinicia():
+    etapas = actual()
+    if etapas is not None:
+        etapas.reinicia()
+
+
+#Modo pedido por la variable de entorno o por la página ('1', 'memoria' o None).
+#tracemalloc queda activo para todo el proceso, así que 'memoria' solo se
+#acepta desde la variable de entorno; desde la página se mide solo el tiempo
+def requested(valor=None):
+    entorno = os.environ.get(ENV)
+    if entorno == 'memoria':
+        return 'memoria'
+    valor = valor or entorno
+    if not valor or valor in ('0', 'false', 'no'):
+        return None
+    return '1'
+
+
+#Empieza a medir en este hilo (o deja de medir si modo es None)
+def start(modo):
+    if modo == 'memoria' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    etapas = Etapas() if modo else None
+    activa(etapas)
+    return etapas
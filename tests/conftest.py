@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covidcol import bench, data as datos
+
+#Las tablas auxiliares (DIVIPOLA y centroides) son las del repositorio; los
+#casos son CSV sintéticos pequeños con la forma del CSV del INS
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLAS = [os.path.join(RAIZ, p) for p in datos.FUENTES[1:]]
+
+FILAS = 3000
+BORRADOS = 100
+NUEVOS = 500
+
+
+#Dos cortes del INS: el segundo quita casos, modifica otros (edad y casos
+#activos que pasan a recuperados) y agrega casos nuevos
+@pytest.fixture(scope='session')
+def cortes(tmp_path_factory):
+    directorio = tmp_path_factory.mktemp('cortes')
+    viejo = bench.synthetic_csv(str(directorio / 'viejo.csv'), FILAS, seed=0, fuentes=[None] + TABLAS)
+    extra = bench.synthetic_csv(str(directorio / 'extra.csv'), NUEVOS, seed=1, fuentes=[None] + TABLAS)
+
+    rng = np.random.default_rng(0)
+    df = pd.read_csv(viejo, sep=';', dtype=str, keep_default_na=False)
+    df = df.drop(rng.choice(len(df), BORRADOS, replace=False)).reset_index(drop=True)
+    edad = rng.choice(len(df), 100, replace=False)
+    df.loc[edad, 'Edad'] = (df.loc[edad, 'Edad'].astype(int) + 30).astype(str)
+    activos = df.index[df['atención'].isin(['Casa', 'Hospital'])][:100]
+    df.loc[activos, 'atención'] = 'Recuperado'
+    df.loc[activos, 'Fecha recuperado'] = (pd.to_datetime(df.loc[activos, 'fecha reporte web']) +
+                                          pd.Timedelta(days=12)).dt.strftime('%Y-%m-%dT00:00:00.000')
+    nuevos = pd.read_csv(extra, sep=';', dtype=str, keep_default_na=False)
+    nuevos['ID de caso'] = (nuevos['ID de caso'].astype(int) + FILAS).astype(str)
+
+    nuevo = str(directorio / 'nuevo.csv')
+    pd.concat([df, nuevos], ignore_index=True).to_csv(nuevo, sep=';', index=False)
+    return viejo, nuevo
@@ -0,0 +1,60 @@
+import os
+import shutil
+
+import pandas as pd
+
+from covidcol import data as datos, store
+
+from conftest import BORRADOS, NUEVOS, TABLAS
+
+
+def _build(csv, cache_dir):
+    fuentes = [csv] + TABLAS
+    huella = store.source_fingerprint(fuentes)
+    store.build_streaming(store.data_version(huella), huella, cache_dir, fuentes, chunksize=1000)
+    return store.load_table(cache_dir)
+
+
+#Un corte nuevo aplicado por id de caso sobre la tabla anterior queda igual
+#que la tabla construida desde cero con ese corte
+def test_upsert_snapshot_matches_full_build(cortes, tmp_path):
+    viejo, nuevo = cortes
+    base_dir = str(tmp_path / 'viejo')
+    base = _build(viejo, base_dir)
+    chunks = datos.read_raw_chunks(nuevo, chunksize=1000)
+    #Bloques pequeños para que las filas nuevas se repartan entre varios
+    writer = store.TableWriter(str(tmp_path / 'upsert'))
+    n_cambios = store.upsert_rows(os.path.realpath(base_dir), store.read_manifest(base_dir), chunks,
+                                  datos.read_lookups(*TABLAS), writer, snapshot=True, bloque=700)
+    writer.commit('upsert', {})
+    df = store.load_table(str(tmp_path / 'upsert'))
+
+    completa = _build(nuevo, str(tmp_path / 'nuevo'))
+    assert n_cambios > NUEVOS
+    assert df.shape[0] == base.shape[0] - BORRADOS + NUEVOS
+    pd.testing.assert_frame_equal(df, completa, check_categorical=False)
+
+
+#Lo mismo por load_or_build cuando el CSV del INS se reemplaza en su lugar
+def test_load_or_build_applies_new_snapshot(cortes, tmp_path):
+    viejo, nuevo = cortes
+    csv = str(tmp_path / 'casos.csv')
+    cache_dir = str(tmp_path / 'cache')
+    shutil.copyfile(viejo, csv)
+    store.load_or_build(cache_dir, [csv] + TABLAS)
+    version = store.read_manifest(cache_dir)['version']
+
+    shutil.copyfile(nuevo, csv)
+    df = store.load_or_build(cache_dir, [csv] + TABLAS)
+    assert store.read_manifest(cache_dir)['version'] != version
+    assert os.path.islink(cache_dir)
+
+    completa = _build(nuevo, str(tmp_path / 'completa'))
+    pd.testing.assert_frame_equal(df, completa, check_categorical=False)
+    pd.testing.assert_frame_equal(store.load_table(cache_dir), completa, check_categorical=False)
+
+    #El reporte de fechas no válidas se arrastra: se restan los casos que
+    #salen y se suman los nuevos
+    fechas_invalidas = store.read_manifest(cache_dir)['fechas_invalidas']
+    assert fechas_invalidas['FIS'] > 0
+    assert fechas_invalidas == store.read_manifest(str(tmp_path / 'completa'))['fechas_invalidas']
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from covidcol import survival
+
+from test_store import _build
+
+
+#Histogramas de activos con la misma cantidad de días de inicio (la versión
+#incremental nunca los recorta) y los departamentos en el mismo orden
+def _alinear(supervivencia, deptos, n_inicio):
+    orden = [supervivencia.deptos.index(d) for d in deptos]
+    activos = np.zeros(supervivencia.activos.shape[:2] + (n_inicio,), dtype=supervivencia.activos.dtype)
+    activos[:, :, :supervivencia.activos.shape[2]] = supervivencia.activos
+    return supervivencia.eventos[orden], activos[orden]
+
+
+#Con casos borrados, modificados y nuevos la versión incremental es igual a
+#la construida desde cero con el corte nuevo
+def test_update_matches_build(cortes, tmp_path):
+    viejo, nuevo = cortes
+    anterior = survival.build_survival(_build(viejo, str(tmp_path / 'viejo')), 'v1')
+    df = _build(nuevo, str(tmp_path / 'nuevo'))
+    incremental = survival.update_survival(anterior, anterior.filas, df, 'v2')
+    completa = survival.build_survival(df, 'v2')
+
+    assert sorted(incremental.deptos) == completa.deptos
+    n_inicio = max(incremental.activos.shape[2], completa.activos.shape[2])
+    for a, b in zip(_alinear(incremental, completa.deptos, n_inicio), _alinear(completa, completa.deptos, n_inicio)):
+        np.testing.assert_array_equal(a, b)
+    assert incremental.corte == completa.corte
+
+    #Los códigos por caso también quedan como los de la versión completa
+    codigos = {'depto': lambda s, v: np.array(s.deptos)[v]}
+    for col in incremental.filas:
+        convertir = codigos.get(col, lambda s, v: v)
+        np.testing.assert_array_equal(convertir(incremental, incremental.filas[col]),
+                                      convertir(completa, completa.filas[col]))
+    pd.testing.assert_frame_equal(incremental.quantiles_by_age('Colombia'), completa.quantiles_by_age('Colombia'))
+
+
+#La versión guardada con sus códigos por caso se actualiza desde el disco
+def test_load_or_build_updates_from_previous_dir(cortes, tmp_path, monkeypatch):
+    viejo, nuevo = cortes
+    anterior_dir = str(tmp_path / 'viejo')
+    survival.load_or_build(_build(viejo, anterior_dir), anterior_dir)
+
+    cache_dir = str(tmp_path / 'nuevo')
+    df = _build(nuevo, cache_dir)
+    build_survival = survival.build_survival
+    with monkeypatch.context() as m:
+        m.setattr(survival, 'build_survival', None)
+        incremental = survival.load_or_build(df, cache_dir, anterior_dir)
+    completa = build_survival(df, incremental.version)
+    for desenlace in survival.DESENLACES:
+        pd.testing.assert_frame_equal(incremental.quantiles_by_age(None, desenlace),
+                                      completa.quantiles_by_age(None, desenlace))